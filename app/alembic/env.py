@@ -10,6 +10,8 @@ from app.models.base import Base
 from app.models.users import User
 from app.models.files import File
 from app.models.experiments import Experiment
+from app.models.jobs import TrainingJob
+from app.models.uploads import UploadSession
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -3,12 +3,14 @@ Consolidatie all routers in one
 """
 
 from fastapi import APIRouter
-from app.api.routers import auth, users, files, experiments
+from app.api.routers import auth, users, files, uploads, experiments, metrics
 
 api_router = APIRouter()
 api_router.include_router(auth.router)
 api_router.include_router(users.router)
+api_router.include_router(uploads.router, prefix="/files/uploads", tags=["files"])
 api_router.include_router(files.router, prefix="/files", tags=["files"])
 api_router.include_router(
     experiments.router, prefix="/experiments", tags=["experiments"]
 )
+api_router.include_router(metrics.router, tags=["metrics"])
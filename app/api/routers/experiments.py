@@ -3,73 +3,68 @@ Define experiments routes.
 """
 
 import asyncio
+import functools
+import json
+import shutil
+import tempfile
+import time
 import aiofiles.os
-from pydantic import BaseModel
+from collections.abc import AsyncIterator, Callable, Hashable, Iterator
+from datetime import datetime
+from pydantic import BaseModel, model_validator
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Annotated
+from typing import Annotated, Literal
 
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
+    Form,
     HTTPException,
+    Query,
     Request,
+    Response,
+    UploadFile,
     status,
 )
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
 from sqlalchemy.orm import SessionEvents, SessionTransactionOrigin
 
-from app.core.db import get_async_session
+from app.api.routers.files import csv_filecheck
+from app.core.db import get_async_session, get_read_session
+from app.core.batching import drop_batcher, get_batcher
+from app.core.cache import model_cache
+from app.core.conditional import entity_tag, not_modified
 from app.core.config import settings
+from app.core.datasets import iter_dataset, read_columns
+from app.core.executor import inference_executor
+from app.core.lazy import lazy_import
+from app.core.inference import (
+    forget_inference,
+    predict_columns,
+    predict_rows,
+    record_inference,
+)
+from app.core.pagination import Order, next_link, paginate, split_page
+from app.core.profiling import span
+from app.core.training import training_scheduler
+from app.core.uploads import CsvFormat, InvalidCsv, UploadTooLarge, save_upload
+from app.core.workers import publish_model_change
 from app.models.users import User, current_active_user
 from app.models.files import File
 from app.models.experiments import Experiment
-from app.schemas.experiments import ExperimentRead, ExperimentCreate
+from app.models.jobs import TrainingJob
+from app.schemas.experiments import ExperimentRead, ExperimentCreate, TrainingJobRead
 
 from fastapi import APIRouter
 
-import joblib
 import uuid
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import LabelEncoder
-from sklearn.ensemble import RandomForestClassifier
-
-router = APIRouter()
-
-MODEL_TARGET = str(settings.MODEL_TARGET)
-
-
-async def run_experiment(
-    data: pd.DataFrame, file: File, experiment: Experiment, session: AsyncSession
-):
-    """background task to run an experiment"""
-
-    schema = "Input: "
 
-    X = data.drop(columns=[experiment.target_col])
-    y = data[experiment.target_col]
+pd = lazy_import("pandas")
 
-    schema += ", ".join([f"{col} ({X[col].dtype})" for col in X.columns])
-
-    label_encoder = LabelEncoder()
-    y_encoded = label_encoder.fit_transform(y)
-
-    schema += " Output: "
-    schema += ", ".join(
-        [f"{label}={index}" for index, label in enumerate(label_encoder.classes_)]
-    )
-
-    model = RandomForestClassifier()
-    model.fit(X, y_encoded)
-
-    model_path = MODEL_TARGET + experiment.title + ".pkl"
-    joblib.dump(model, model_path)
-
-    setattr(experiment, "model_path", model_path)
-    setattr(experiment, "model_schema", schema)
-    session.add(experiment)
-    await session.commit()
+router = APIRouter()
 
 
 async def get_experiment_or_404(
@@ -77,79 +72,188 @@ async def get_experiment_or_404(
 ) -> Experiment:
     """dependency to get an experiment or return 404"""
 
-    experiment = await session.get(Experiment, id)
+    with span("db.get_experiment"):
+        experiment = await session.get(Experiment, id)
     if not experiment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
     return experiment
 
 
+async def read_experiment_or_404(
+    id: uuid.UUID, session: Annotated[AsyncSession, Depends(get_read_session)]
+) -> Experiment:
+    """dependency to get an experiment for reading only, on the replica if available"""
+
+    return await get_experiment_or_404(id, session)
+
+
 @router.post("/", response_model=ExperimentRead)
 async def create_experiment(
     user: Annotated[User, Depends(current_active_user)],
     experiment_create: ExperimentCreate,
     session: Annotated[AsyncSession, Depends(get_async_session)],
-    bg: BackgroundTasks,
 ):
-    file = await session.get(File, experiment_create.file_id)
+    with span("db.get_file"):
+        file = await session.get(File, experiment_create.file_id)
     if not file:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="ID of a non-existent file"
         )
 
-    if user is not file.user:
+    if file.user_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Only owned files could be used",
         )
 
-    data = await asyncio.to_thread(pd.read_csv, file.path)
-    if experiment_create.target_col not in data.columns:
+    if file.profile is not None:
+        columns = [column["name"] for column in file.profile["columns"]]
+    else:
+        with span("read_columns"):
+            columns = await asyncio.to_thread(read_columns, file.path)
+
+    if experiment_create.target_col not in columns:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Target column not in file"
         )
 
-    new_experiment = Experiment(**experiment_create.model_dump(), user=user)
+    new_experiment = Experiment(**experiment_create.model_dump(), user_id=user.id)
     session.add(new_experiment)
-    await session.commit()
+    await session.flush()
 
-    bg.add_task(run_experiment, data, file, new_experiment, session)
+    job = TrainingJob(experiment_id=new_experiment.id)
+    session.add(job)
+    with span("db.commit"):
+        await session.commit()
+
+    training_scheduler.submit(job.id)
 
     return new_experiment
 
 
+def release_model(experiment_id: uuid.UUID) -> None:
+    """drops the model of an experiment loaded by this worker, with its batcher"""
+
+    model_cache.invalidate(experiment_id)
+    drop_batcher(experiment_id)
+    forget_inference(experiment_id)
+
+
+def experiment_version(experiment: Experiment) -> datetime:
+    return experiment.updated or experiment.date
+
+
 @router.get("/", response_model=list[ExperimentRead])
 async def list_experiments(
+    request: Request,
+    response: Response,
     user: Annotated[User, Depends(current_active_user)],
-    session: Annotated[AsyncSession, Depends(get_async_session)],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+    order: Order = "desc",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    live: bool | None = None,
 ):
-    return user.experiments
+    """lists experiments of the user by date, the Link header points at the next page"""
+
+    statement = select(Experiment).where(Experiment.user_id == user.id)
+    if live is not None:
+        statement = statement.where(Experiment.live == live)
+
+    try:
+        statement = paginate(statement, Experiment, cursor, order, limit, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    experiments, next_cursor = split_page(
+        list(await session.scalars(statement)), limit
+    )
+
+    etag = entity_tag(
+        next_cursor,
+        *(
+            f"{experiment.id}@{experiment_version(experiment)}"
+            for experiment in experiments
+        ),
+    )
+    if cached := not_modified(request, response, etag):
+        return cached
+
+    if next_cursor is not None:
+        response.headers["Link"] = next_link(request, next_cursor)
+
+    return experiments
 
 
 @router.get("/{id}", response_model=ExperimentRead)
 async def get_experiment(
+    request: Request,
+    response: Response,
     user: Annotated[User, Depends(current_active_user)],
-    experiment: Annotated[Experiment, Depends(get_experiment_or_404)],
+    experiment: Annotated[Experiment, Depends(read_experiment_or_404)],
 ):
+    version = experiment_version(experiment)
+    if cached := not_modified(
+        request, response, entity_tag(experiment.id, version), version
+    ):
+        return cached
+
     return experiment
 
 
+@router.get("/{id}/job", response_model=TrainingJobRead)
+async def get_experiment_job(
+    request: Request,
+    response: Response,
+    user: Annotated[User, Depends(current_active_user)],
+    experiment: Annotated[Experiment, Depends(read_experiment_or_404)],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+):
+    if experiment.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="you cannot read an experiment that is not yours!",
+        )
+
+    job = await session.scalar(
+        select(TrainingJob)
+        .where(TrainingJob.experiment_id == experiment.id)
+        .order_by(TrainingJob.date.desc())
+        .limit(1)
+    )
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    etag = entity_tag(job.id, job.status, job.started, job.finished)
+    if cached := not_modified(request, response, etag):
+        return cached
+
+    return job
+
+
 @router.delete("/{id}")
 async def delete_experiment(
     user: Annotated[User, Depends(current_active_user)],
     experiment: Annotated[Experiment, Depends(get_experiment_or_404)],
     session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-    if user is not experiment.user:
+    if experiment.user_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="you cannot delete an experiment that is not yours!",
         )
 
-    await aiofiles.os.remove(experiment.model_path)
+    if experiment.model_path:
+        await aiofiles.os.remove(experiment.model_path)
     await session.delete(experiment)
     await session.commit()
 
+    release_model(experiment.id)
+    publish_model_change(experiment.id)
+
 
 @router.post("/live/{id}", response_model=ExperimentRead)
 async def toggle_live(
@@ -157,7 +261,7 @@ async def toggle_live(
     experiment: Annotated[Experiment, Depends(get_experiment_or_404)],
     session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-    if user is not experiment.user:
+    if experiment.user_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="you cannot toggle an experiment that is not yours!",
@@ -166,10 +270,39 @@ async def toggle_live(
     current_status = experiment.live
     new_status = not current_status
 
+    if new_status and not experiment.model_path:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="the model of the experiment is not trained",
+        )
+
     setattr(experiment, "live", new_status)
     session.add(experiment)
     await session.commit()
 
+    release_model(experiment.id)
+    publish_model_change(experiment.id)
+
+    return experiment
+
+
+async def get_live_experiment(
+    experiment: Annotated[Experiment, Depends(read_experiment_or_404)],
+) -> Experiment:
+    """dependency to get an experiment that is live to accept inference"""
+
+    if not experiment.live:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="experiment is not live to be used",
+        )
+
+    if not experiment.model_path:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="the model of the experiment is not trained",
+        )
+
     return experiment
 
 
@@ -177,21 +310,247 @@ class ModelIn(BaseModel):
     input: list[int | float | str]
 
 
+class ModelBatchIn(BaseModel):
+    """many inputs to score at once, either as rows or as named columns"""
+
+    rows: list[list[int | float | str]] | None = None
+    columns: dict[str, list[int | float | str]] | None = None
+
+    @model_validator(mode="after")
+    def check_one_layout(self) -> "ModelBatchIn":
+        if (self.rows is None) == (self.columns is None):
+            raise ValueError("provide exactly one of rows or columns")
+        return self
+
+
+async def run_inference(
+    predict: Callable, key: Hashable, model_path: str, data, wait: bool = False
+) -> list[str]:
+    """scores data on the inference executor, recording the latency of the call"""
+
+    started = time.perf_counter()
+    with span("predict"):
+        res = await inference_executor.run(predict, key, model_path, data, wait=wait)
+    record_inference(key, len(res), time.perf_counter() - started)
+    return res
+
+
 @router.post("/model/{id}")
 async def predict_model(
     model_in: ModelIn,
     user: Annotated[User, Depends(current_active_user)],
-    experiment: Annotated[Experiment, Depends(get_experiment_or_404)],
-    session: Annotated[AsyncSession, Depends(get_async_session)],
+    experiment: Annotated[Experiment, Depends(get_live_experiment)],
 ):
-    if not experiment.live:
+    batcher = get_batcher(
+        experiment.id,
+        functools.partial(
+            run_inference,
+            predict_rows,
+            experiment.id,
+            experiment.model_path,
+        ),
+    )
+
+    try:
+        res = await batcher.submit(model_in.input)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return {"output": res}
+
+
+@router.post("/model/{id}/batch")
+async def predict_model_batch(
+    model_in: ModelBatchIn,
+    user: Annotated[User, Depends(current_active_user)],
+    experiment: Annotated[Experiment, Depends(get_live_experiment)],
+):
+    if model_in.rows is not None:
+        n_rows = len(model_in.rows)
+        predict, data = predict_rows, model_in.rows
+    else:
+        n_rows = max((len(col) for col in model_in.columns.values()), default=0)
+        predict, data = predict_columns, model_in.columns
+
+    if n_rows > settings.PREDICT_BATCH_MAX_ROWS:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="experiment is not live to be used",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"at most {settings.PREDICT_BATCH_MAX_ROWS} rows per batch",
         )
 
-    model = joblib.load(experiment.model_path)
-    data = np.array(model_in.input).reshape(1, -1)
-    res = model.predict(data)[0]
+    try:
+        res = await run_inference(predict, experiment.id, experiment.model_path, data)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return {"outputs": res}
+
+
+async def score_chunks(
+    key: Hashable, model_path: str, chunks: Iterator["pd.DataFrame"]
+) -> AsyncIterator[list[str]]:
+    """scores chunks of rows on the inference executor, one predict call per chunk
+
+    once the first chunk is scored the response has started, so later chunks wait for
+    a free worker of a saturated executor instead of failing the response midway
+    """
+
+    wait = False
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        yield await run_inference(predict_columns, key, model_path, chunk, wait=wait)
+        wait = True
+
+
+def format_predictions(res: list[str], output: str) -> str:
+    if output == "csv":
+        return "".join(f"{r}\n" for r in res)
+    return "".join(json.dumps({"output": f"{r}"}) + "\n" for r in res)
+
+
+async def stream_predictions(
+    first: list[str], scored: AsyncIterator[list[str]], output: str
+) -> AsyncIterator[str]:
+    """yields predictions as csv or ndjson lines"""
+
+    if output == "csv":
+        yield "output\n"
+
+    yield format_predictions(first, output)
+    async for res in scored:
+        yield format_predictions(res, output)
+
+
+def read_csv_chunks(
+    path: str, columns: list[str] | None, csv_format: CsvFormat
+) -> Iterator["pd.DataFrame"]:
+    """yields the given columns of a csv file in chunks of rows, in that order"""
+
+    with pd.read_csv(
+        path,
+        usecols=columns,
+        chunksize=settings.PREDICT_CSV_CHUNKSIZE,
+        sep=csv_format.delimiter,
+        encoding=csv_format.encoding,
+    ) as reader:
+        for chunk in reader:
+            yield chunk[columns] if columns is not None else chunk
 
-    return {"output": f"{res}"}
+
+async def training_columns(
+    session: AsyncSession, experiment: Experiment
+) -> list[str] | None:
+    """columns the model of an experiment was trained on, read from its training file
+
+    None once that file is deleted, predict_columns then selects them on the executor,
+    so the model is never loaded outside of it
+    """
+
+    file = await session.get(File, experiment.file_id)
+    if file is None:
+        return None
+
+    if file.profile is not None:
+        columns = [column["name"] for column in file.profile["columns"]]
+    else:
+        columns = await asyncio.to_thread(read_columns, file.path)
+
+    return [column for column in columns if column != experiment.target_col]
+
+
+@router.post("/model/{id}/csv")
+async def predict_model_csv(
+    user: Annotated[User, Depends(current_active_user)],
+    experiment: Annotated[Experiment, Depends(get_live_experiment)],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    csv_file: Annotated[UploadFile | None, Depends(csv_filecheck)],
+    file_id: Annotated[uuid.UUID | None, Form()] = None,
+    output: Annotated[Literal["csv", "ndjson"], Form()] = "csv",
+):
+    if (csv_file is None) == (file_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide either a CSV file or the ID of an uploaded file",
+        )
+
+    usecols = await training_columns(session, experiment)
+
+    cleanup = None
+    if csv_file:
+        # the upload is closed before the response streams, so it is copied first
+        directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="score-")
+        cleanup = BackgroundTask(shutil.rmtree, directory, ignore_errors=True)
+        try:
+            path, _, csv_format = await save_upload(
+                csv_file, directory, compress=False
+            )
+        except UploadTooLarge as e:
+            await cleanup()
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+            )
+        except InvalidCsv as e:
+            await cleanup()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Bad-Formatted CSV file, {e}",
+            )
+
+        try:
+            with span("read_csv"):
+                header = await asyncio.to_thread(
+                    pd.read_csv,
+                    path,
+                    nrows=0,
+                    sep=csv_format.delimiter,
+                    encoding=csv_format.encoding,
+                )
+        except Exception:
+            await cleanup()
+            raise
+        columns = list(header.columns)
+        chunks = read_csv_chunks(path, usecols, csv_format)
+    else:
+        file = await session.get(File, file_id)
+        if not file:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="ID of a non-existent file",
+            )
+
+        if user.id != file.user_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Only owned files could be used",
+            )
+
+        columns = await asyncio.to_thread(read_columns, file.path)
+        chunks = iter_dataset(file.path, usecols, settings.PREDICT_CSV_CHUNKSIZE)
+
+    if usecols is not None:
+        missing = [col for col in usecols if col not in columns]
+        if missing:
+            if cleanup:
+                await cleanup()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"missing columns: {', '.join(missing)}",
+            )
+
+    scored = score_chunks(experiment.id, experiment.model_path, chunks)
+    try:
+        # scored before the response starts, so a saturated executor is a 503
+        first = await anext(scored, [])
+    except Exception as e:
+        if cleanup:
+            await cleanup()
+        if isinstance(e, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        raise
+
+    media_type = "text/csv" if output == "csv" else "application/x-ndjson"
+
+    return StreamingResponse(
+        stream_predictions(first, scored, output),
+        media_type=media_type,
+        background=cleanup,
+    )
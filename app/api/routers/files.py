@@ -4,27 +4,61 @@ Define files routers
 
 from typing import Annotated
 
-import io
 import os
 import re
 import uuid
 import aiofiles
 import aiofiles.os
 import asyncio
+from datetime import datetime
+from functools import partial
 
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.compression import accepts_encoding, content_encoding, iter_decompressed
+from app.core.conditional import (
+    StoredFileResponse,
+    entity_tag,
+    etag_matches,
+    http_date,
+    not_modified,
+)
 from app.core.config import settings
-
-import pandas as pd
-
-from fastapi import APIRouter, Depends, HTTPException, Form, File, UploadFile, status
-from fastapi.responses import FileResponse
-
-from app.core.db import get_async_session
+from app.core.pagination import Order, next_link, paginate, split_page
+from app.core.profiling import span
+from app.core.datasets import (
+    convert_csv,
+    parquet_path,
+    read_columns,
+    read_rows,
+    remove_dataset,
+)
+from app.core.uploads import (
+    InvalidCsv,
+    SavedUpload,
+    UploadTooLarge,
+    save_upload,
+)
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Form,
+    File,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    status,
+)
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.core.db import get_async_session, get_read_session, lock_key
 from app.models.users import User, current_active_user
 from app.models.files import File as FileModel
-from app.schemas.files import FileRead
+from app.schemas.files import FileRead, FileProfile, FileRows
 
 router = APIRouter()
 
@@ -36,7 +70,10 @@ async def csv_filecheck(
         UploadFile | None, File(description="structured data in a .csv file")
     ] = None
 ) -> UploadFile | None:
-    """dependency to check if the file is a csv file"""
+    """dependency to check if the file is a csv file
+
+    its content is only checked once it is saved, so its first chunk is read once
+    """
 
     if not file:
         return None
@@ -55,24 +92,84 @@ async def csv_filecheck(
             detail="Invalid filename. Only alphanumeric characters, underscores, periods, and hyphens are allowed",
         )
 
+    file.filename = filename
+
+    return file
+
+
+async def store_csv(
+    csv_file: UploadFile, session: AsyncSession
+) -> tuple[SavedUpload, dict]:
+    """stores an uploaded csv file by content hash and returns it with its profile
+
+    the stored bytes are locked until the transaction of session ends, so they cannot
+    be released before the file referencing them is committed
+    """
+
     try:
-        content = await file.read()
-        content_str = io.BytesIO(content)
-        df = await asyncio.to_thread(pd.read_csv, content_str)
+        upload = await save_upload(
+            csv_file, UPLOAD_TARGET, on_hash=partial(lock_key, session)
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+        )
+    except InvalidCsv as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Bad-Formatted CSV file, {e}",
+        )
+
+    return upload, await profile_csv(upload, session)
 
-        if df.empty:
-            raise ValueError("empty csv file")
 
-        del df
-    except Exception as e:
+async def profile_csv(upload: SavedUpload, session: AsyncSession) -> dict:
+    """builds the parquet copy of a stored csv file and returns its profile
+
+    content already stored for another file is reused as is, without parsing it again
+    """
+
+    twin = await session.scalar(
+        select(FileModel)
+        .where(
+            FileModel.content_hash == upload.content_hash,
+            FileModel.profile.is_not(None),
+        )
+        .limit(1)
+    )
+    if twin is not None and await aiofiles.os.path.exists(parquet_path(upload.path)):
+        return twin.profile
+
+    try:
+        with span("convert_csv"):
+            return await asyncio.to_thread(
+                convert_csv,
+                upload.path,
+                upload.csv_format.delimiter,
+                upload.csv_format.encoding,
+            )
+    except Exception:
+        await release_dataset(upload.path, session)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Bad-Formatted CSV file"
         )
 
-    await file.seek(0)
-    file.filename = filename
 
-    return file
+async def release_dataset(path: str, session: AsyncSession) -> None:
+    """removes the stored bytes of a dataset once no file references them anymore
+
+    counts the references in its own transaction holding the lock of the bytes, so an
+    upload of the same content either is counted or finds them removed and stores them
+    again
+    """
+
+    await lock_key(session, path)
+    references = await session.scalar(
+        select(func.count()).select_from(FileModel).where(FileModel.path == path)
+    )
+    if not references:
+        await asyncio.to_thread(remove_dataset, path)
+    await session.commit()
 
 
 async def get_file_or_404(
@@ -80,30 +177,192 @@ async def get_file_or_404(
 ) -> FileModel:
     """dependency to get a file or raise 404 HTTP exception"""
 
-    file = await session.get(FileModel, id)
+    with span("db.get_file"):
+        file = await session.get(FileModel, id)
 
     if file is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     return file
 
 
+async def read_file_or_404(
+    id: uuid.UUID, session: Annotated[AsyncSession, Depends(get_read_session)]
+) -> FileModel:
+    """dependency to get a file for reading only, on the replica if available"""
+
+    return await get_file_or_404(id, session)
+
+
+def file_version(file: FileModel) -> datetime:
+    return file.updated or file.date
+
+
 @router.get("/", response_model=list[FileRead])
-async def list_files(user: Annotated[User, Depends(current_active_user)]):
-    return user.files
+async def list_files(
+    request: Request,
+    response: Response,
+    user: Annotated[User, Depends(current_active_user)],
+    session: Annotated[AsyncSession, Depends(get_read_session)],
+    cursor: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+    order: Order = "desc",
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """lists the files of the user by date, the Link header points at the next page"""
+
+    try:
+        statement = paginate(
+            select(FileModel).where(FileModel.user_id == user.id),
+            FileModel,
+            cursor,
+            order,
+            limit,
+            since,
+            until,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    files, next_cursor = split_page(list(await session.scalars(statement)), limit)
+
+    etag = entity_tag(
+        next_cursor, *(f"{file.id}@{file_version(file)}" for file in files)
+    )
+    if cached := not_modified(request, response, etag):
+        return cached
+
+    if next_cursor is not None:
+        response.headers["Link"] = next_link(request, next_cursor)
+
+    return files
 
 
 @router.get("/{id}", response_model=FileRead)
-async def get_file(file: Annotated[FileModel, Depends(get_file_or_404)]):
+async def get_file(
+    request: Request,
+    response: Response,
+    file: Annotated[FileModel, Depends(read_file_or_404)],
+):
+    version = file_version(file)
+    if cached := not_modified(request, response, entity_tag(file.id, version), version):
+        return cached
+
     return file
 
 
+@router.get("/{id}/profile", response_model=FileProfile)
+async def get_file_profile(
+    request: Request,
+    response: Response,
+    user: Annotated[User, Depends(current_active_user)],
+    file: Annotated[FileModel, Depends(read_file_or_404)],
+):
+    if file.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="you cannot read a file that is not yours!",
+        )
+
+    if file.profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="file was uploaded before profiles were computed",
+        )
+
+    # the profile only depends on the content of the file
+    etag = entity_tag("profile", file.content_hash or file_version(file))
+    if cached := not_modified(request, response, etag, file_version(file)):
+        return cached
+
+    return file.profile
+
+
+@router.get("/{id}/rows", response_model=FileRows)
+async def get_file_rows(
+    request: Request,
+    response: Response,
+    user: Annotated[User, Depends(current_active_user)],
+    file: Annotated[FileModel, Depends(read_file_or_404)],
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    columns: Annotated[list[str] | None, Query()] = None,
+):
+    if file.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="you cannot read a file that is not yours!",
+        )
+
+    if columns is not None:
+        # columns=a,b and columns=a&columns=b are both accepted
+        columns = [name for value in columns for name in value.split(",") if name]
+
+        if file.profile is not None:
+            known = {column["name"] for column in file.profile["columns"]}
+        else:
+            known = set(await asyncio.to_thread(read_columns, file.path))
+        missing = [name for name in columns if name not in known]
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"missing columns: {', '.join(missing)}",
+            )
+
+    etag = entity_tag(
+        "rows", file.content_hash or file_version(file), offset, limit, columns
+    )
+    if cached := not_modified(request, response, etag):
+        return cached
+
+    page, total = await asyncio.to_thread(read_rows, file.path, offset, limit, columns)
+
+    return {
+        "offset": offset,
+        "total": total,
+        "columns": list(page.columns),
+        # missing values are sent as nulls
+        "rows": page.astype(object).where(page.notna(), None).values.tolist(),
+    }
+
+
 @router.get("/download/{id}")
 async def download_file(
+    request: Request,
     user: Annotated[User, Depends(current_active_user)],
-    file: Annotated[FileModel, Depends(get_file_or_404)],
+    file: Annotated[FileModel, Depends(read_file_or_404)],
 ):
-    if user is file.user:
-        return FileResponse(file.path)
+    if file.user_id == user.id:
+        if file.content_hash is None:
+            # stored before content hashes, validated from the file stat
+            return FileResponse(file.path)
+
+        # the content hash is the sha256 of the uncompressed bytes, compressed
+        # bytes are another representation of the file with their own tag
+        encoding = content_encoding(file.path)
+        headers = {
+            "ETag": f'"{file.content_hash}"',
+            "Last-Modified": http_date(file_version(file)),
+        }
+        if encoding is not None:
+            headers["Vary"] = "Accept-Encoding"
+            # compressed files are sent as stored when the client can decode them
+            if accepts_encoding(request.headers.get("accept-encoding", ""), encoding):
+                headers["ETag"] = f'"{file.content_hash}-{encoding}"'
+                headers["Content-Encoding"] = encoding
+
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            headers.pop("Content-Encoding", None)
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if encoding is None or "Content-Encoding" in headers:
+            return StoredFileResponse(file.path, media_type="text/csv", headers=headers)
+
+        return StreamingResponse(
+            iter_decompressed(file.path, settings.UPLOAD_CHUNK_BYTES),
+            media_type="text/csv",
+            headers=headers,
+        )
 
     return {"msg": "file is not public to download"}
 
@@ -120,14 +379,16 @@ async def create_file(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Provide a CSV file"
         )
 
-    file_path = UPLOAD_TARGET + str(csv_file.filename)
-    new_file = FileModel(user=user, title=title, path=file_path)
-    session.add(new_file)
-
-    async with aiofiles.open(file_path, "wb") as f:
-        while content := await csv_file.read(1024):
-            await f.write(content)
+    upload, profile = await store_csv(csv_file, session)
 
+    new_file = FileModel(
+        user_id=user.id,
+        title=title,
+        path=upload.path,
+        content_hash=upload.content_hash,
+        profile=profile,
+    )
+    session.add(new_file)
     await session.commit()
     return new_file
 
@@ -138,16 +399,17 @@ async def delete_file(
     file: Annotated[FileModel, Depends(get_file_or_404)],
     session: Annotated[AsyncSession, Depends(get_async_session)],
 ):
-    if user is not file.user:
+    if file.user_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="you cannot delete a file that is not yours!",
         )
 
-    await aiofiles.os.remove(file.path)
     await session.delete(file)
     await session.commit()
 
+    await release_dataset(file.path, session)
+
 
 @router.patch("/{id}", response_model=FileRead)
 async def patch_file(
@@ -157,7 +419,7 @@ async def patch_file(
     csv_file: Annotated[UploadFile | None, Depends(csv_filecheck)],
     title: Annotated[str | None, Form()] = None,
 ):
-    if user is not file.user:
+    if file.user_id != user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="you cannot modify a file that is not yours!",
@@ -166,16 +428,20 @@ async def patch_file(
     if title:
         setattr(file, "title", title)
 
+    old_path = None
     if csv_file:
-        await aiofiles.os.remove(file.path)
+        upload, profile = await store_csv(csv_file, session)
 
-        file_path = UPLOAD_TARGET + str(csv_file.filename)
-        setattr(file, "path", file_path)
-        async with aiofiles.open(file_path, "wb") as f:
-            while content := await csv_file.read(1024):
-                await f.write(content)
+        if upload.path != file.path:
+            old_path = file.path
+        setattr(file, "path", upload.path)
+        setattr(file, "content_hash", upload.content_hash)
+        setattr(file, "profile", profile)
 
     session.add(file)
     await session.commit()
 
+    if old_path:
+        await release_dataset(old_path, session)
+
     return file
@@ -0,0 +1,28 @@
+"""
+Define metrics route
+"""
+
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core import workers
+from app.core.metrics import REGISTRY
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """metrics of this process, or of every process of app.serve by worker label"""
+
+    if workers.metrics_directory is None:
+        text = REGISTRY.render()
+    else:
+        text = await asyncio.to_thread(workers.collect_metrics)
+
+    return PlainTextResponse(
+        text, media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,224 @@
+"""
+Define resumable upload routers
+
+a csv file is sent as numbered parts of UPLOAD_PART_BYTES bytes, in any order and
+possibly in parallel, a dropped part is sent again and the file is created from the
+parts once all of them were received, sessions not completed within
+UPLOAD_SESSION_TTL_SECONDS are removed with their parts
+"""
+
+from typing import Annotated
+
+import uuid
+import shutil
+import asyncio
+from datetime import datetime, timedelta
+from functools import partial
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
+
+from app.core.config import settings
+from app.core import db
+from app.core.db import get_async_session, lock_key
+from app.core.uploads import (
+    InvalidCsv,
+    PartError,
+    UploadTooLarge,
+    assemble_parts,
+    n_parts,
+    part_size,
+    received_parts,
+    remove_session_directories,
+    save_part,
+    session_directory,
+)
+from app.api.routers.files import UPLOAD_TARGET, profile_csv
+from app.models.users import User, current_active_user
+from app.models.files import File as FileModel
+from app.models.uploads import UploadSession
+from app.schemas.files import FileRead
+from app.schemas.uploads import UploadSessionCreate, UploadSessionRead
+
+router = APIRouter()
+
+
+async def get_upload_or_404(
+    id: uuid.UUID,
+    user: Annotated[User, Depends(current_active_user)],
+    session: Annotated[AsyncSession, Depends(get_async_session)],
+) -> UploadSession:
+    """dependency to get an upload session of the user or raise 404 HTTP exception"""
+
+    upload = await session.get(UploadSession, id)
+
+    if upload is None or upload.user_id != user.id or upload.date < expiry_cutoff():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return upload
+
+
+def expiry_cutoff() -> datetime:
+    """creation date before which upload sessions are expired"""
+    return datetime.now() - timedelta(seconds=settings.UPLOAD_SESSION_TTL_SECONDS)
+
+
+async def expire_uploads() -> None:
+    """removes the expired upload sessions and their parts"""
+
+    cutoff = expiry_cutoff()
+    async with db.async_session_maker() as session:
+        expired = set(
+            await session.scalars(
+                select(UploadSession.id).where(UploadSession.date < cutoff)
+            )
+        )
+        if expired:
+            await session.execute(
+                delete(UploadSession).where(UploadSession.id.in_(expired))
+            )
+            await session.commit()
+        live = set(await session.scalars(select(UploadSession.id)))
+
+    await asyncio.to_thread(
+        remove_session_directories, live, expired, cutoff.timestamp()
+    )
+
+
+def read_upload(upload: UploadSession) -> UploadSessionRead:
+    received = received_parts(session_directory(upload.id))
+    return UploadSessionRead(
+        id=upload.id,
+        title=upload.title,
+        size=upload.size,
+        part_size=upload.part_size,
+        parts=n_parts(upload.size, upload.part_size),
+        received=[
+            {
+                "number": number,
+                "offset": number * upload.part_size,
+                "size": part_size(upload.size, upload.part_size, number),
+            }
+            for number in received
+        ],
+        date=upload.date,
+    )
+
+
+@router.post("/", response_model=UploadSessionRead)
+async def create_upload(
+    user: Annotated[User, Depends(current_active_user)],
+    session: Annotated[AsyncSession, Depends(get_async_session)],
+    upload_in: UploadSessionCreate,
+    background_tasks: BackgroundTasks,
+):
+    if upload_in.size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"files are limited to {settings.UPLOAD_MAX_BYTES} bytes",
+        )
+
+    upload = UploadSession(
+        user_id=user.id,
+        title=upload_in.title,
+        size=upload_in.size,
+        part_size=settings.UPLOAD_PART_BYTES,
+    )
+    session.add(upload)
+    await session.commit()
+
+    # every new session sweeps the sessions abandoned before it
+    background_tasks.add_task(expire_uploads)
+
+    return read_upload(upload)
+
+
+@router.get("/{id}", response_model=UploadSessionRead)
+async def get_upload(upload: Annotated[UploadSession, Depends(get_upload_or_404)]):
+    return await asyncio.to_thread(read_upload, upload)
+
+
+@router.put("/{id}/parts/{number}", status_code=status.HTTP_204_NO_CONTENT)
+async def put_upload_part(
+    number: int,
+    request: Request,
+    upload: Annotated[UploadSession, Depends(get_upload_or_404)],
+):
+    try:
+        await save_part(
+            request.stream(),
+            session_directory(upload.id),
+            number,
+            upload.size,
+            upload.part_size,
+        )
+    except PartError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except InvalidCsv as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Bad-Formatted CSV file, {e}",
+        )
+
+
+@router.post("/{id}/complete", response_model=FileRead)
+async def complete_upload(
+    user: Annotated[User, Depends(current_active_user)],
+    session: Annotated[AsyncSession, Depends(get_async_session)],
+    upload: Annotated[UploadSession, Depends(get_upload_or_404)],
+):
+    directory = session_directory(upload.id)
+    count = n_parts(upload.size, upload.part_size)
+
+    received = await asyncio.to_thread(received_parts, directory)
+    missing = sorted(set(range(count)) - set(received))
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"missing parts: {missing}",
+        )
+
+    try:
+        saved = await assemble_parts(
+            directory, count, UPLOAD_TARGET, partial(lock_key, session)
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e)
+        )
+    except InvalidCsv as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Bad-Formatted CSV file, {e}",
+        )
+
+    profile = await profile_csv(saved, session)
+
+    new_file = FileModel(
+        user_id=user.id,
+        title=upload.title,
+        path=saved.path,
+        content_hash=saved.content_hash,
+        profile=profile,
+    )
+    session.add(new_file)
+    await session.delete(upload)
+    await session.commit()
+
+    await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+
+    return new_file
+
+
+@router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_upload(
+    session: Annotated[AsyncSession, Depends(get_async_session)],
+    upload: Annotated[UploadSession, Depends(get_upload_or_404)],
+):
+    await session.delete(upload)
+    await session.commit()
+
+    await asyncio.to_thread(
+        shutil.rmtree, session_directory(upload.id), ignore_errors=True
+    )
@@ -0,0 +1,8 @@
+"""
+Benchmark suite of the upload, training and inference paths
+
+drives the application in process through httpx.ASGITransport with concurrent clients,
+against the database it is configured with, run it with
+
+    python -m app.benchmarks --output results.json --baseline baseline.json
+"""
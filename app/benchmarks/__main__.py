@@ -0,0 +1,58 @@
+"""
+Runs the benchmark suite, writing its results as json
+
+exits with status 1 when a statistic regressed beyond the tolerance of the baseline
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from dataclasses import fields
+
+from app.benchmarks.suite import Parameters, compare, run
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks")
+    for field in fields(Parameters):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}", type=int, default=field.default
+        )
+    parser.add_argument("--output", help="file to write the results to, or stdout")
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative change of a statistic tolerated before it is a regression",
+    )
+    args = parser.parse_args()
+
+    params = Parameters(
+        **{field.name: getattr(args, field.name) for field in fields(Parameters)}
+    )
+    results = asyncio.run(run(params))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Synthetic datasets for benchmarks
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_csv(
+    rows: int, columns: int, cardinality: int, classes: int = 2, seed: int = 0
+) -> bytes:
+    """csv file of rows with columns numeric features and a label column
+
+    even features are floats, odd features are integers taking cardinality values, the
+    label depends on the first feature so models have something to learn
+    """
+
+    rng = np.random.default_rng(seed)
+
+    data = {}
+    for i in range(columns):
+        if i % 2:
+            data[f"f{i}"] = rng.integers(0, cardinality, rows)
+        else:
+            data[f"f{i}"] = rng.normal(size=rows).round(6)
+
+    bins = np.quantile(data["f0"], np.linspace(0, 1, classes + 1)[1:-1])
+    data["label"] = np.char.add("class_", np.digitize(data["f0"], bins).astype(str))
+
+    buffer = io.StringIO()
+    pd.DataFrame(data).to_csv(buffer, index=False)
+    return buffer.getvalue().encode()
+
+
+def feature_rows(rows: int, columns: int, cardinality: int, seed: int = 1) -> list:
+    """rows of features shaped like the ones of synthetic_csv, to score"""
+
+    rng = np.random.default_rng(seed)
+    return [
+        [
+            int(rng.integers(0, cardinality)) if i % 2 else float(rng.normal())
+            for i in range(columns)
+        ]
+        for _ in range(rows)
+    ]
@@ -0,0 +1,87 @@
+"""
+Import time report of the application
+
+imports app.main in a fresh interpreter with -X importtime and reports the total time,
+the slowest modules and the heavy modules imported at startup, run it with
+
+    python -m app.benchmarks.imports --limit 20
+
+exits with status 1 when a module meant to be imported lazily is imported at startup
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from app.core.lazy import HEAVY_MODULES
+
+
+def import_times(module: str) -> list[tuple[str, int, int]]:
+    """(module, self, cumulative) import times in microseconds, in import order"""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        if not own.strip().isdigit():
+            continue
+        times.append((name.strip(), int(own), int(cumulative)))
+
+    return times
+
+
+def report(module: str, limit: int) -> dict:
+    times = import_times(module)
+    imported = {name for name, _, _ in times}
+    top_level = [entry for entry in times if entry[0] == module]
+
+    return {
+        "module": module,
+        "seconds": top_level[-1][2] / 1e6 if top_level else 0.0,
+        "modules": len(times),
+        "slowest": [
+            {"module": name, "self": own / 1e6, "cumulative": cumulative / 1e6}
+            for name, own, cumulative in sorted(times, key=lambda t: -t[2])[:limit]
+        ],
+        "heavy": [name for name in HEAVY_MODULES if name in imported],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks.imports")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="report as json")
+    args = parser.parse_args()
+
+    result = report(args.module, args.limit)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(
+            f"import {result['module']}: {result['seconds']:.3f}s, "
+            f"{result['modules']} modules"
+        )
+        for entry in result["slowest"]:
+            print(
+                f"{entry['cumulative']:9.3f}s {entry['self']:9.3f}s  {entry['module']}"
+            )
+        for name in result["heavy"]:
+            print(f"imported at startup: {name}")
+
+    return 1 if result["heavy"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
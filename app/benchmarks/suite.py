@@ -0,0 +1,294 @@
+"""
+Benchmark scenarios, their statistics and comparisons against a baseline
+"""
+
+import asyncio
+import math
+import os
+import platform
+import resource
+import sys
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+import httpx
+from asgi_lifespan import LifespanManager
+
+from app.benchmarks.data import feature_rows, synthetic_csv
+from app.core.config import settings
+
+
+BENCHMARK_PASSWORD = "#1Benchmark"
+
+# whether a larger value of a statistic is an improvement
+HIGHER_IS_BETTER = {
+    "throughput": True,
+    "rows_per_second": True,
+    "p50": False,
+    "p95": False,
+    "p99": False,
+}
+
+
+@dataclass
+class Parameters:
+    rows: int = 10_000
+    columns: int = 10
+    cardinality: int = 20
+    classes: int = 2
+    uploads: int = 8
+    requests: int = 500
+    concurrency: int = 16
+    batch_rows: int = 1000
+    # seconds to wait for the training job before giving up
+    training_timeout: int = 600
+
+
+def percentile(values: list[float], q: float) -> float:
+    """nearest-rank percentile of values"""
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = math.ceil(q / 100 * len(values))
+    return values[min(len(values) - 1, max(0, rank - 1))]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def run_concurrently(
+    n: int, concurrency: int, send: Callable[[int], Awaitable[httpx.Response]]
+) -> dict:
+    """sends n requests from concurrency clients and summarizes their latencies"""
+
+    indices = iter(range(n))
+    latencies: list[float] = []
+    errors = 0
+
+    async def client() -> None:
+        nonlocal errors
+        for i in indices:
+            started = time.perf_counter()
+            res = await send(i)
+            latencies.append(time.perf_counter() - started)
+            if res.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def peak_rss() -> dict:
+    """peak resident memory of this process and of its finished children, in bytes"""
+
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+async def login(client: httpx.AsyncClient) -> None:
+    email = f"bench-{uuid.uuid4().hex[:12]}@semiml.dev"
+    await client.post(
+        "/auth/register", json={"email": email, "password": BENCHMARK_PASSWORD}
+    )
+    res = await client.post(
+        "/auth/jwt/login", data={"username": email, "password": BENCHMARK_PASSWORD}
+    )
+    res.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {res.json()['access_token']}"
+
+
+async def bench_upload(client: httpx.AsyncClient, params: Parameters) -> dict:
+    # every upload is distinct content, so none is deduplicated
+    datasets = [
+        synthetic_csv(
+            params.rows, params.columns, params.cardinality, params.classes, seed=i
+        )
+        for i in range(params.uploads)
+    ]
+    ids: list[str] = []
+
+    async def send(i: int) -> httpx.Response:
+        res = await client.post(
+            "/files/",
+            data={"title": f"benchmark {i}"},
+            files={"file": (f"benchmark_{i}.csv", datasets[i], "text/csv")},
+        )
+        if res.status_code == 200:
+            ids.append(res.json()["id"])
+        return res
+
+    result = await run_concurrently(params.uploads, params.concurrency, send)
+    result["bytes_per_second"] = (
+        sum(map(len, datasets)) / result["seconds"] if result["seconds"] else 0.0
+    )
+    result["file_ids"] = ids
+    return result
+
+
+async def bench_training(
+    client: httpx.AsyncClient, params: Parameters, file_id: str
+) -> dict:
+    started = time.perf_counter()
+    res = await client.post(
+        "/experiments/",
+        json={"title": "benchmark", "file_id": file_id, "target_col": "label"},
+    )
+    res.raise_for_status()
+    experiment_id = res.json()["id"]
+
+    deadline = started + params.training_timeout
+    while True:
+        job = (await client.get(f"/experiments/{experiment_id}/job")).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        if time.perf_counter() > deadline:
+            raise RuntimeError(
+                f"training did not finish within {params.training_timeout}s, "
+                f"the job is {job['status']}"
+            )
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+
+    if job["status"] == "failed":
+        raise RuntimeError(f"training failed: {job['error']}")
+
+    training = (
+        datetime.fromisoformat(job["finished"]) - datetime.fromisoformat(job["started"])
+    ).total_seconds()
+    return {
+        "experiment_id": experiment_id,
+        "seconds": elapsed,
+        "training_seconds": training,
+        "rows_per_second": params.rows / training if training else 0.0,
+    }
+
+
+async def bench_predict(
+    client: httpx.AsyncClient, params: Parameters, experiment_id: str
+) -> dict:
+    rows = feature_rows(params.requests, params.columns, params.cardinality)
+
+    async def send(i: int) -> httpx.Response:
+        return await client.post(
+            f"/experiments/model/{experiment_id}", json={"input": rows[i]}
+        )
+
+    return await run_concurrently(params.requests, params.concurrency, send)
+
+
+async def bench_predict_batch(
+    client: httpx.AsyncClient, params: Parameters, experiment_id: str
+) -> dict:
+    rows = feature_rows(params.batch_rows, params.columns, params.cardinality)
+    n = max(1, params.requests // 10)
+
+    async def send(i: int) -> httpx.Response:
+        return await client.post(
+            f"/experiments/model/{experiment_id}/batch", json={"rows": rows}
+        )
+
+    result = await run_concurrently(n, params.concurrency, send)
+    result["rows_per_second"] = result["throughput"] * params.batch_rows
+    return result
+
+
+async def run(params: Parameters) -> dict:
+    """runs every scenario in order against a fresh user, cleaning up after them"""
+
+    from app.core.executor import inference_executor
+    from app.core.training import training_scheduler
+    from app.main import app
+
+    results: dict = {}
+    async with LifespanManager(app):
+        transport = httpx.ASGITransport(app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            await login(client)
+
+            upload = await bench_upload(client, params)
+            file_ids = upload.pop("file_ids")
+            results["upload"] = upload
+            if not file_ids:
+                raise RuntimeError("no upload succeeded")
+
+            training = await bench_training(client, params, file_ids[0])
+            experiment_id = training.pop("experiment_id")
+            results["training"] = training
+
+            await client.post(f"/experiments/live/{experiment_id}")
+            results["predict"] = await bench_predict(client, params, experiment_id)
+            results["predict_batch"] = await bench_predict_batch(
+                client, params, experiment_id
+            )
+
+            await client.delete(f"/experiments/{experiment_id}")
+            for file_id in file_ids:
+                await client.delete(f"/files/{file_id}")
+
+        # the pools are joined so their processes count in the peak of the children
+        inference_executor.shutdown(wait=True)
+        await training_scheduler.shutdown(wait=True)
+
+    return {
+        "date": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "inference_executor": settings.INFERENCE_EXECUTOR,
+            "inference_workers": settings.INFERENCE_WORKERS,
+        },
+        "parameters": asdict(params),
+        "scenarios": results,
+        "peak_rss_bytes": peak_rss(),
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """describes the statistics of current worse than baseline by more than tolerance,
+    and the scenarios with more errors than in baseline
+    """
+
+    regressions = []
+    for scenario, stats in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario, {})
+
+        # errors are not noise, any error beyond the baseline is a regression
+        if stats.get("errors", 0) > base.get("errors", 0):
+            regressions.append(
+                f"{scenario}.errors: {base.get('errors', 0)} -> {stats['errors']}"
+            )
+
+        for name, higher_is_better in HIGHER_IS_BETTER.items():
+            if name not in stats or not base.get(name):
+                continue
+
+            change = (stats[name] - base[name]) / base[name]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(
+                    f"{scenario}.{name}: {base[name]:.4g} -> {stats[name]:.4g} "
+                    f"({change:+.1%})"
+                )
+
+    return regressions
@@ -0,0 +1,145 @@
+"""
+Dynamic micro-batching of concurrent predictions
+
+single-row predictions arriving together for the same model are queued and flushed
+as one vectorized call, after a maximum batch size or a maximum wait
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable, Sequence
+from typing import Any
+
+from app.core.config import settings
+from app.core.inference import SchemaError
+from app.core.metrics import Histogram
+
+
+PREDICT_BATCH_SIZE = Histogram(
+    "semiml_predict_microbatch_size",
+    "rows per flushed micro-batch",
+    labelnames=("experiment",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+
+
+class MicroBatcher:
+    """queues rows for one model and scores them together
+
+    predict receives a list of rows of the same width and returns one result per row,
+    a SchemaError fails every row of the batch at once, as they share their width, and
+    a batch failing with another ValueError is split in halves scored apart until the
+    bad rows are isolated
+    """
+
+    def __init__(
+        self,
+        key: Hashable,
+        predict: Callable[[list[Sequence[Any]]], Awaitable[Sequence[Any]]],
+        max_size: int,
+        max_wait: float,
+    ):
+        self.key = key
+        self.predict = predict
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._pending: list[tuple[Sequence[Any], asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, row: Sequence[Any]) -> Any:
+        """queues a row and waits for its own result"""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self) -> None:
+        """sends every queued row to be scored"""
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        PREDICT_BATCH_SIZE.labels(self.key).observe(len(batch))
+
+        # rows of different widths cannot be stacked into one array
+        groups: dict[int, list[tuple[Sequence[Any], asyncio.Future]]] = {}
+        for item in batch:
+            groups.setdefault(len(item[0]), []).append(item)
+
+        for group in groups.values():
+            task = asyncio.create_task(self._run(group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Sequence[Any], asyncio.Future]]) -> None:
+        try:
+            results = await self.predict([row for row, _ in batch])
+        except SchemaError as e:
+            self._fail(batch, e)
+            return
+        except ValueError as e:
+            if len(batch) == 1:
+                self._fail(batch, e)
+                return
+
+            # so a single bad row only fails its own caller
+            middle = len(batch) // 2
+            await asyncio.gather(self._run(batch[:middle]), self._run(batch[middle:]))
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(
+        batch: list[tuple[Sequence[Any], asyncio.Future]], error: Exception
+    ) -> None:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+
+_batchers: dict[Hashable, MicroBatcher] = {}
+
+
+def get_batcher(
+    key: Hashable,
+    predict: Callable[[list[Sequence[Any]]], Awaitable[Sequence[Any]]],
+) -> MicroBatcher:
+    """returns the micro-batcher of a model, creating it on first use"""
+
+    batcher = _batchers.get(key)
+    if batcher is None:
+        batcher = _batchers[key] = MicroBatcher(
+            key,
+            predict,
+            max_size=settings.PREDICT_MICROBATCH_MAX_SIZE,
+            max_wait=settings.PREDICT_MICROBATCH_MAX_WAIT_MS / 1000,
+        )
+
+    return batcher
+
+
+def drop_batcher(key: Hashable) -> None:
+    """flushes and forgets the micro-batcher of a model"""
+
+    batcher = _batchers.pop(key, None)
+    if batcher is not None:
+        batcher.flush()
+        PREDICT_BATCH_SIZE.remove(key)
@@ -0,0 +1,186 @@
+"""
+In-process cache of trained models
+
+keeps unpickled models in memory so inference does not load them from disk on every request
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from concurrent.futures import Future
+from typing import Any, NamedTuple
+
+from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.core.metrics import Counter, Gauge, Histogram
+from app.core.profiling import span
+
+
+joblib = lazy_import("joblib")
+
+
+MODEL_CACHE_HITS = Counter("semiml_model_cache_hits_total", "model cache hits")
+MODEL_CACHE_MISSES = Counter("semiml_model_cache_misses_total", "model cache misses")
+MODEL_CACHE_EVICTIONS = Counter(
+    "semiml_model_cache_evictions_total", "models evicted from the model cache"
+)
+MODEL_CACHE_BYTES = Gauge(
+    "semiml_model_cache_bytes", "estimated bytes held by the model cache"
+)
+MODEL_CACHE_ENTRIES = Gauge("semiml_model_cache_entries", "models held by the cache")
+MODEL_LOAD_SECONDS = Histogram(
+    "semiml_model_load_seconds",
+    "time to load a model file on a cache miss",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+class _Entry(NamedTuple):
+    path: str
+    version: int
+    size: int
+    model: Any
+
+
+def footprint(model: Any) -> int:
+    """estimated in-memory size of a model, the bytes of the arrays it holds
+
+    the footprint of sklearn estimators is dominated by their numpy arrays, which are
+    found by walking the state the estimators would pickle, without serializing it
+    """
+
+    size = 0
+    # the states are built on the fly, they are kept so their ids are not reused
+    seen: dict[int, Any] = {}
+    stack = [model]
+    while stack:
+        obj = stack.pop()
+        if obj is None or isinstance(obj, (bool, int, float, type)) or id(obj) in seen:
+            continue
+        seen[id(obj)] = obj
+
+        nbytes = getattr(obj, "nbytes", None)
+        if isinstance(nbytes, int):
+            size += nbytes
+        elif isinstance(obj, (str, bytes)):
+            size += len(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            try:
+                stack.append(obj.__getstate__())
+            except Exception:
+                continue
+
+    return size
+
+
+class ModelCache:
+    """LRU cache of loaded models, bounded by a memory budget in bytes
+
+    entries are keyed by experiment id and versioned by the model file path and mtime,
+    so a retrained or replaced model file is picked up on the next lookup
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # models being loaded by a miss, by key, path and version
+        self._loading: dict[tuple[Hashable, str, int], Future] = {}
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, path: str) -> Any:
+        """returns the model stored at path, loading it on a miss
+
+        concurrent misses of the same model wait for the first one to load it
+        """
+
+        stat = os.stat(path)
+        version = (key, path, stat.st_mtime_ns)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is not None
+                and entry.path == path
+                and entry.version == stat.st_mtime_ns
+            ):
+                self._entries.move_to_end(key)
+                MODEL_CACHE_HITS.inc()
+                return entry.model
+
+            MODEL_CACHE_MISSES.inc()
+            loading = self._loading.get(version)
+            first = loading is None
+            if first:
+                loading = self._loading[version] = Future()
+
+        if not first:
+            return loading.result()
+
+        try:
+            started = time.perf_counter()
+            with span("model.load"):
+                model = joblib.load(path)
+            MODEL_LOAD_SECONDS.observe(time.perf_counter() - started)
+            self.put(key, _Entry(path, stat.st_mtime_ns, footprint(model), model))
+        except BaseException as e:
+            loading.set_exception(e)
+            raise
+        else:
+            loading.set_result(model)
+        finally:
+            with self._lock:
+                del self._loading[version]
+
+        return model
+
+    def put(self, key: Hashable, entry: _Entry) -> None:
+        """stores an entry, evicting least recently used ones to stay within budget"""
+
+        with self._lock:
+            self._discard(key)
+
+            if entry.size > self.max_bytes:
+                return
+
+            while self._entries and self._size + entry.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                MODEL_CACHE_EVICTIONS.inc()
+
+            self._entries[key] = entry
+            self._size += entry.size
+
+    def invalidate(self, key: Hashable) -> None:
+        """drops a model from the cache"""
+        with self._lock:
+            self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+
+model_cache = ModelCache(settings.MODEL_CACHE_MAX_BYTES)
+
+MODEL_CACHE_BYTES.set_function(lambda: model_cache.size)
+MODEL_CACHE_ENTRIES.set_function(lambda: len(model_cache))
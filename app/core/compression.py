@@ -0,0 +1,88 @@
+"""
+Transparent compression of stored files
+
+datasets are compressed while they are written to disk and decompressed in chunks
+while they are read, and compressed bytes are sent as they are to clients accepting
+their encoding
+"""
+
+import gzip
+import zlib
+from collections.abc import Iterator
+
+from app.core.config import settings
+
+
+# suffix of the stored files and HTTP content coding of every codec
+CODECS = {"gzip": (".gz", "gzip")}
+
+
+class Compressor:
+    """incremental compressor of a stored file, passes bytes through without a codec"""
+
+    def __init__(self, codec: str | None, level: int = 6):
+        self.suffix = ""
+        self._compressor = None
+
+        if codec is not None:
+            self.suffix = CODECS[codec][0]
+            # wbits 31 writes a gzip header and trailer around the deflate stream
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    @property
+    def enabled(self) -> bool:
+        return self._compressor is not None
+
+    def compress(self, data: bytes) -> bytes:
+        if self._compressor is None:
+            return data
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        if self._compressor is None:
+            return b""
+        return self._compressor.flush()
+
+
+def dataset_compressor(compress: bool = True) -> Compressor:
+    """compressor for a new dataset, following DATASET_COMPRESSION"""
+
+    codec = settings.DATASET_COMPRESSION if compress else None
+    return Compressor(codec, settings.DATASET_COMPRESSION_LEVEL)
+
+
+def content_encoding(path: str) -> str | None:
+    """HTTP content coding of a stored file, None when it is stored uncompressed"""
+
+    for suffix, encoding in CODECS.values():
+        if path.endswith(suffix):
+            return encoding
+    return None
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """tells whether an Accept-Encoding header allows a content coding"""
+
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+
+    return False
+
+
+def iter_decompressed(path: str, chunk_size: int) -> Iterator[bytes]:
+    """yields the decompressed content of a stored file in chunks"""
+
+    opener = gzip.open if content_encoding(path) == "gzip" else open
+    with opener(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
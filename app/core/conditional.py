@@ -0,0 +1,82 @@
+"""
+Conditional requests
+
+validators (ETag and Last-Modified) for files, experiments and their downloads, so
+clients polling them get an empty 304 response while nothing changed
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+
+def entity_tag(*parts: object) -> str:
+    """strong entity tag derived from the parts identifying a version of a resource"""
+
+    digest = hashlib.sha256("\x1f".join(map(str, parts)).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def http_date(value: datetime) -> str:
+    """formats a datetime as an HTTP date, naive datetimes are in local time"""
+    return formatdate(value.astimezone(timezone.utc).timestamp(), usegmt=True)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """weak comparison of an If-None-Match header with an entity tag"""
+
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+def not_modified(
+    request: Request,
+    response: Response,
+    etag: str,
+    last_modified: datetime | None = None,
+) -> Response | None:
+    """sets the validators of a response, returns a 304 response when the client has it"""
+
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    response.headers.update(headers)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return None
+
+
+class StoredFileResponse(FileResponse):
+    """file response whose If-Range validators are its own ETag and Last-Modified
+
+    FileResponse compares If-Range with validators derived from the file stat, which
+    differ from the ones set from the database, so If-Range is evaluated here and the
+    request reaches FileResponse with a bare Range when it matches and without otherwise
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if_range = Headers(scope=scope).get("if-range")
+        dropped = {b"if-range"}
+        if if_range is not None and if_range not in (
+            self.headers.get("etag"),
+            self.headers.get("last-modified"),
+        ):
+            dropped.add(b"range")
+
+        headers = [
+            (key, value) for key, value in scope["headers"] if key not in dropped
+        ]
+        await super().__call__({**scope, "headers": headers}, receive, send)
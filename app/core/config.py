@@ -49,6 +49,59 @@ class Settings(BaseSettings):
     UPLOAD_TARGET: str = expand_tilde("~/uploads/")
     MODEL_TARGET: str = expand_tilde("~/models/")
 
+    CSV_CHECK_ROWS: int = 1000
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+    UPLOAD_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+    UPLOAD_PART_BYTES: int = 8 * 1024 * 1024
+    # resumable uploads not completed in time are removed with their parts
+    UPLOAD_SESSION_TTL_SECONDS: float = 24 * 60 * 60
+    PARQUET_ROW_GROUP_SIZE: int = 100_000
+    PARQUET_INDEX_ROWS: int = 10_000
+    DATASET_COMPRESSION: Literal["gzip"] | None = "gzip"
+    DATASET_COMPRESSION_LEVEL: int = 6
+    MODEL_COMPRESSION_LEVEL: int = 3
+
+    MODEL_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    PREDICT_BATCH_MAX_ROWS: int = 100_000
+    PREDICT_CSV_CHUNKSIZE: int = 10_000
+    PREDICT_MICROBATCH_MAX_SIZE: int = 64
+    PREDICT_MICROBATCH_MAX_WAIT_MS: float = 2.0
+
+    # limits of the whole server, split between the preforked workers of app.serve
+    INFERENCE_EXECUTOR: Literal["thread", "process"] = "thread"
+    INFERENCE_WORKERS: int = 4
+    INFERENCE_MAX_PENDING: int = 256
+
+    USER_CACHE_TTL_SECONDS: float = 30.0
+    USER_CACHE_MAX_SIZE: int = 10_000
+
+    TRAINING_MAX_CONCURRENT: int = 2
+    TRAINING_MAX_CORES: int = os.cpu_count() or 1
+    # running jobs still running after it on shutdown are marked failed
+    TRAINING_SHUTDOWN_TIMEOUT: float = 30.0
+    # the trainer process of app.serve looks for jobs queued by the workers this often
+    TRAINING_POLL_INTERVAL: float = 1.0
+
+    PROFILE_TARGET: str = expand_tilde("~/profiles/")
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_INTERVAL_MS: float = 5.0
+
+    # preforked workers of app.serve, 0 requests never recycles them
+    SERVE_WORKERS: int = os.cpu_count() or 1
+    SERVE_MAX_REQUESTS: int = 0
+    SERVE_MAX_REQUESTS_JITTER: int = 0
+    SERVE_GRACEFUL_TIMEOUT: int = 30
+    SERVE_PRELOAD_MODELS: bool = True
+    # every process of app.serve publishes its metrics this often, for /metrics
+    SERVE_METRICS_INTERVAL: float = 5.0
+
+    # imports the ML libraries in the background once the app started
+    IMPORT_PREWARM: bool = True
+
+    # 0 disables the event loop watchdog
+    LOOP_WATCHDOG_INTERVAL_MS: float = 100.0
+    LOOP_STALL_THRESHOLD_MS: float = 250.0
+
     @computed_field
     @property
     def all_cors_origins(self) -> list[str]:
@@ -72,5 +125,38 @@ class Settings(BaseSettings):
             path=self.POSTGRES_DB,
         )
 
+    # a streaming replica of the database, read with the same credentials, or with the
+    # driver and credentials of a full url
+    POSTGRES_REPLICA_HOST: str | None = None
+    POSTGRES_REPLICA_PORT: int = 5432
+    POSTGRES_REPLICA_DSN: PostgresDsn | None = None
+
+    @computed_field
+    @property
+    def SQLALCHEMY_REPLICA_URI(self) -> PostgresDsn | None:
+        if self.POSTGRES_REPLICA_DSN is not None:
+            return self.POSTGRES_REPLICA_DSN
+
+        if self.POSTGRES_REPLICA_HOST is None:
+            return None
+
+        return MultiHostUrl.build(
+            scheme="postgresql+asyncpg",
+            username=self.POSTGRES_USER,
+            password=self.POSTGRES_PASSWORD,
+            host=self.POSTGRES_REPLICA_HOST,
+            port=self.POSTGRES_REPLICA_PORT,
+            path=self.POSTGRES_DB,
+        )
+
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_REPLICA_MAX_LAG: float = 5.0
+    DB_REPLICA_CHECK_INTERVAL: float = 2.0
+
 
 settings = Settings()
@@ -0,0 +1,264 @@
+"""
+Columnar copies of uploaded datasets
+
+every uploaded csv file is parsed once, stored next to it as parquet and profiled,
+so training and column checks read typed columns or metadata instead of parsing the
+csv again, and pages of rows are read from the few row groups holding them
+"""
+
+import os
+import time
+import uuid
+from collections.abc import Iterator
+
+from app.core.config import settings
+from app.core.lazy import lazy_import
+from app.core.metrics import Histogram
+
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+
+CSV_PARSE_SECONDS = Histogram(
+    "semiml_csv_parse_seconds",
+    "time to parse, convert and profile an uploaded csv file",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+
+def parquet_path(csv_path: str) -> str:
+    """path of the parquet copy of a csv file"""
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+class DatasetProfiler:
+    """accumulates a dataset profile over chunks of rows
+
+    distinct counts are estimated with a k-minimum-values sketch of the hashed
+    values, they are exact while a column holds fewer than k distinct values
+    """
+
+    def __init__(self, k: int = 1024):
+        self.k = k
+        self.rows = 0
+        self.columns: dict[str, dict] = {}
+        self._sketches: dict[str, np.ndarray] = {}
+
+    def update(self, chunk: "pd.DataFrame") -> None:
+        self.rows += len(chunk)
+        nulls = chunk.isna().sum()
+
+        for name in chunk.columns:
+            series = chunk[name]
+            dtype = str(series.dtype)
+            column = self.columns.setdefault(
+                name,
+                {"name": name, "dtype": dtype, "nulls": 0},
+            )
+            if column["dtype"] != dtype:
+                # the type the column is read back with, not the one of its first chunk
+                column["dtype"] = str(np.result_type(column["dtype"], series.dtype))
+            column["nulls"] += int(nulls[name])
+
+            values = series.dropna()
+            if values.empty:
+                continue
+
+            if pd.api.types.is_numeric_dtype(series.dtype):
+                low, high = values.min().item(), values.max().item()
+                column["min"] = min(column.get("min", low), low)
+                column["max"] = max(column.get("max", high), high)
+
+            hashes = np.unique(pd.util.hash_array(values.to_numpy()))
+            sketch = self._sketches.get(name)
+            if sketch is not None:
+                hashes = np.union1d(sketch, hashes)
+            self._sketches[name] = hashes[: self.k]
+
+    def result(self) -> dict:
+        columns = []
+        for name, column in self.columns.items():
+            sketch = self._sketches.get(name, np.empty(0, dtype=np.uint64))
+            if len(sketch) < self.k:
+                distinct = len(sketch)
+            else:
+                # (k - 1) / (k-th smallest hash scaled to [0, 1])
+                distinct = int((self.k - 1) / (float(sketch[-1]) / 2.0**64))
+            columns.append({**column, "distinct": distinct})
+
+        return {"rows": self.rows, "columns": columns}
+
+
+def widened_dtypes(csv_path: str, **read_options) -> dict[str, str]:
+    """types fitting every chunk of a csv file, for the columns inferred differently
+
+    a column holding text in any chunk is read as text, a column mixing integers and
+    floats as floats, like a parse of the whole file would type them
+    """
+
+    kinds: dict[str, set[str]] = {}
+    with pd.read_csv(
+        csv_path, chunksize=settings.PARQUET_ROW_GROUP_SIZE, **read_options
+    ) as reader:
+        for chunk in reader:
+            for name, dtype in chunk.dtypes.items():
+                kinds.setdefault(name, set()).add(dtype.kind)
+
+    return {
+        name: "float64" if found <= {"i", "u", "f"} else "str"
+        for name, found in kinds.items()
+        if len(found) > 1
+    }
+
+
+def _write_chunks(csv_path: str, path: str, **read_options) -> DatasetProfiler:
+    """streams csv chunks into parquet row groups typed like the first chunk"""
+
+    profiler = DatasetProfiler()
+    writer = None
+
+    try:
+        with pd.read_csv(
+            csv_path, chunksize=settings.PARQUET_ROW_GROUP_SIZE, **read_options
+        ) as reader:
+            for chunk in reader:
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    table = pa.Table.from_pandas(
+                        chunk, schema=writer.schema, preserve_index=False
+                    )
+                writer.write_table(table, row_group_size=settings.PARQUET_INDEX_ROWS)
+                profiler.update(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return profiler
+
+
+def convert_csv(csv_path: str, delimiter: str = ",", encoding: str = "utf-8") -> dict:
+    """parses a csv file in chunks, writing its parquet copy and profiling it
+
+    row groups hold PARQUET_INDEX_ROWS rows, so the row counts in the parquet footer
+    are a sparse index of the rows, returns the dataset profile and raises ValueError
+    when the file cannot be parsed or holds no rows
+    """
+
+    path = parquet_path(csv_path)
+    # written aside and renamed, as uploads of the same content share this path
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    read_options = {"sep": delimiter, "encoding": encoding}
+    started = time.perf_counter()
+
+    try:
+        try:
+            profiler = _write_chunks(csv_path, tmp_path, **read_options)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # a later chunk was inferred with other types than the first one, the
+            # file is written again in chunks with types fitting all of them
+            dtype = widened_dtypes(csv_path, **read_options)
+            profiler = _write_chunks(csv_path, tmp_path, dtype=dtype, **read_options)
+
+        if not profiler.rows:
+            raise ValueError("empty csv file")
+
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    CSV_PARSE_SECONDS.observe(time.perf_counter() - started)
+    return profiler.result()
+
+
+def read_columns(csv_path: str) -> list[str]:
+    """column names of a dataset, read from the parquet metadata when available"""
+
+    path = parquet_path(csv_path)
+    if os.path.exists(path):
+        return pq.read_schema(path).names
+
+    return list(pd.read_csv(csv_path, nrows=0).columns)
+
+
+def load_dataset(csv_path: str, columns: list[str] | None = None) -> "pd.DataFrame":
+    """loads a dataset, optionally only some of its columns
+
+    the parquet copy is memory-mapped when available, files uploaded before
+    parquet copies existed fall back to parsing the csv
+    """
+
+    path = parquet_path(csv_path)
+    if os.path.exists(path):
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def iter_dataset(
+    csv_path: str, columns: list[str] | None = None, chunksize: int = 10_000
+) -> Iterator["pd.DataFrame"]:
+    """yields a dataset in chunks of rows, optionally only some of its columns in that order"""
+
+    path = parquet_path(csv_path)
+    if os.path.exists(path):
+        parquet = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            chunk = batch.to_pandas()
+            yield chunk[columns] if columns is not None else chunk
+        return
+
+    with pd.read_csv(csv_path, usecols=columns, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk[columns] if columns is not None else chunk
+
+
+def read_rows(
+    csv_path: str, offset: int, limit: int, columns: list[str] | None = None
+) -> tuple["pd.DataFrame", int | None]:
+    """reads limit rows of a dataset from offset, returns them with the number of rows
+
+    only the row groups holding the page are read, located from the row counts in the
+    parquet footer, files uploaded before parquet copies existed are parsed up to the
+    page and their number of rows is unknown
+    """
+
+    path = parquet_path(csv_path)
+    if not os.path.exists(path):
+        data = pd.read_csv(
+            csv_path, usecols=columns, skiprows=range(1, offset + 1), nrows=limit
+        )
+        return (data[columns] if columns is not None else data), None
+
+    parquet = pq.ParquetFile(path, memory_map=True)
+    metadata = parquet.metadata
+    starts = np.cumsum(
+        [0] + [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    )
+    total = int(starts[-1])
+    columns = columns if columns is not None else parquet.schema_arrow.names
+
+    if offset >= total:
+        return parquet.schema_arrow.empty_table().select(columns).to_pandas(), total
+
+    first = int(np.searchsorted(starts, offset, side="right")) - 1
+    last = int(np.searchsorted(starts, min(offset + limit, total), side="left"))
+    table = parquet.read_row_groups(list(range(first, last)), columns=columns)
+
+    page = table.slice(offset - int(starts[first]), limit).select(columns)
+    return page.to_pandas(), total
+
+
+def remove_dataset(csv_path: str) -> None:
+    """removes a csv file and its parquet copy"""
+
+    for path in (csv_path, parquet_path(csv_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
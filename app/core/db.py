@@ -1,21 +1,248 @@
 """
 Creates a database connection and establishes a session maker
+
+the connection pools are sized from the settings and report their use as metrics, a
+read replica gets its own engine when POSTGRES_REPLICA_HOST or POSTGRES_REPLICA_DSN is
+set, and read-only sessions are opened on it while it is reachable and not lagging
 """
 
+import asyncio
+import contextlib
+import hashlib
+import time
 from collections.abc import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy import func, make_url, select, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 
 from app.core.config import settings
+from app.core.metrics import Counter, Gauge, Histogram
+
+
+DB_POOL_SIZE = Gauge(
+    "semiml_db_pool_size", "connections kept open by the pool", labelnames=("pool",)
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "semiml_db_pool_checked_out",
+    "connections currently in use",
+    labelnames=("pool",),
+)
+DB_POOL_OVERFLOW = Gauge(
+    "semiml_db_pool_overflow",
+    "connections open beyond the pool size, negative while the pool is not full",
+    labelnames=("pool",),
+)
+DB_POOL_WAIT = Histogram(
+    "semiml_db_pool_wait_seconds",
+    "time spent waiting for a pooled connection",
+    labelnames=("pool",),
+)
+DB_POOL_TIMEOUTS = Counter(
+    "semiml_db_pool_timeouts_total",
+    "connection requests that timed out waiting on the pool",
+    labelnames=("pool",),
+)
+DB_REPLICA_HEALTHY = Gauge(
+    "semiml_db_replica_healthy", "1 while read-only sessions are sent to the replica"
+)
+DB_REPLICA_LAG = Gauge(
+    "semiml_db_replica_lag_seconds", "replication lag of the replica at its last check"
+)
+DB_READ_SESSIONS = Counter(
+    "semiml_db_read_sessions_total",
+    "read-only sessions opened, by the engine serving them",
+    labelnames=("pool",),
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """queue pool timing every checkout, labelled by its logging name"""
+
+    def __init__(self, *args, logging_name: str | None = None, **kw):
+        # pools replacing this one on dispose are built with the same logging name
+        super().__init__(*args, logging_name=logging_name, **kw)
+        self.name = logging_name or "default"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.labels(self.name).inc()
+            raise
+        finally:
+            DB_POOL_WAIT.labels(self.name).observe(time.perf_counter() - start)
+
+
+def create_engine(url: str, name: str) -> AsyncEngine:
+    """creates an engine with a pool tuned from the settings"""
+
+    connect_args = {}
+    if make_url(url).get_driver_name() == "asyncpg":
+        # statement caches must be disabled behind a transaction-mode pgbouncer
+        connect_args = {
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+
+    engine = create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_logging_name=name,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+    # the pool is read at collection time, as disposing an engine replaces it
+    DB_POOL_SIZE.labels(name).set_function(lambda: engine.pool.size())
+    DB_POOL_CHECKED_OUT.labels(name).set_function(lambda: engine.pool.checkedout())
+    DB_POOL_OVERFLOW.labels(name).set_function(lambda: engine.pool.overflow())
+
+    return engine
 
 
 CONNECTION_STRING = str(settings.SQLALCHEMY_DATABASE_URI)
 
-engine = create_async_engine(CONNECTION_STRING)
+engine = create_engine(CONNECTION_STRING, "primary")
 
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
+replica_engine = None
+if settings.SQLALCHEMY_REPLICA_URI is not None:
+    replica_engine = create_engine(str(settings.SQLALCHEMY_REPLICA_URI), "replica")
+
+
+# seconds since the last replayed transaction, 0 once the replica replayed all it
+# received and null on a server that is not a standby
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class ReplicaMonitor:
+    """checks every interval seconds that a replica is up and lags at most max_lag
+
+    an engine that is not a postgres standby is only checked to be reachable
+    """
+
+    def __init__(self, engine: AsyncEngine, max_lag: float, interval: float):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.interval = interval
+        self.healthy = False
+        self.lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def _replica_lag(self) -> float | None:
+        async with self.engine.connect() as connection:
+            if self.engine.dialect.name == "postgresql":
+                return await connection.scalar(REPLICA_LAG_QUERY)
+            return await connection.scalar(text("SELECT 0"))
+
+    async def check(self) -> None:
+        try:
+            lag = await asyncio.wait_for(self._replica_lag(), timeout=self.interval)
+        except (OSError, DBAPIError, PoolTimeoutError, asyncio.TimeoutError):
+            self.mark_down()
+            return
+
+        self.lag = float(lag or 0)
+        self.healthy = self.lag <= self.max_lag
+
+    def mark_down(self) -> None:
+        """stops sending reads to the replica until its next successful check"""
+        self.healthy = False
+
+    async def _run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+replica_session_maker = None
+replica_monitor = None
+if replica_engine is not None:
+    replica_session_maker = async_sessionmaker(replica_engine, expire_on_commit=False)
+    replica_monitor = ReplicaMonitor(
+        replica_engine, settings.DB_REPLICA_MAX_LAG, settings.DB_REPLICA_CHECK_INTERVAL
+    )
+
+DB_REPLICA_HEALTHY.set_function(
+    lambda: int(replica_monitor is not None and replica_monitor.healthy)
+)
+DB_REPLICA_LAG.set_function(lambda: replica_monitor.lag if replica_monitor else 0)
+
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     """dependency to get an async session from the session maker"""
     async with async_session_maker() as session:
         yield session
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """dependency to get a session for read-only queries
+
+    the session is opened on the replica while it is healthy and on the primary
+    otherwise, data written by the same client may not be visible on it yet
+    """
+
+    if replica_monitor is not None and replica_monitor.healthy:
+        async with replica_session_maker() as session:
+            try:
+                await session.connection()
+            except (OSError, DBAPIError, PoolTimeoutError):
+                replica_monitor.mark_down()
+            else:
+                DB_READ_SESSIONS.labels("replica").inc()
+                yield session
+                return
+
+    DB_READ_SESSIONS.labels("primary").inc()
+    async with async_session_maker() as session:
+        yield session
+
+
+async def lock_key(session: AsyncSession, key: str) -> None:
+    """locks key until the transaction of session ends
+
+    a postgres advisory lock, so it serializes the transactions of every process working
+    on the same key, other databases take no lock
+    """
+
+    if session.bind.dialect.name != "postgresql":
+        return
+
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    await session.execute(
+        select(func.pg_advisory_xact_lock(int.from_bytes(digest, "big", signed=True)))
+    )
+
+
+async def dispose_engines() -> None:
+    """closes the pooled connections of every engine"""
+
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
@@ -0,0 +1,124 @@
+"""
+Bounded executor for blocking work
+
+runs CPU-bound calls such as model inference on a thread or process pool, off the event
+loop, and rejects new work instead of queueing it forever once the pool is saturated
+"""
+
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Literal, TypeVar
+
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge, Histogram
+
+
+T = TypeVar("T")
+
+
+class ExecutorSaturated(Exception):
+    """raised when an executor already holds its maximum number of pending calls"""
+
+
+def _timed(fn: Callable[..., T], *args: Any) -> tuple[float, T]:
+    """runs fn and reports the monotonic time it started at"""
+    return time.monotonic(), fn(*args)
+
+
+class BoundedExecutor:
+    """thread or process pool accepting at most max_pending queued and running calls"""
+
+    def __init__(
+        self,
+        name: str,
+        kind: Literal["thread", "process"],
+        workers: int,
+        max_pending: int,
+    ):
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Executor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._pending = 0
+
+        self._depth = Gauge(
+            f"semiml_{name}_queue_depth", f"{name} calls queued or running"
+        )
+        self._depth.set_function(lambda: self._pending)
+        self._wait = Histogram(
+            f"semiml_{name}_wait_seconds", f"time {name} calls wait for a worker"
+        )
+        self._rejected = Counter(
+            f"semiml_{name}_rejected_total", f"{name} calls rejected as saturated"
+        )
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # forking a process running threads may copy locks held by them
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=self.name
+                )
+        return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: Any, wait: bool = False) -> T:
+        """runs fn(*args) on the pool, raising ExecutorSaturated when it is full
+
+        wait=True waits for a free slot instead, for calls that cannot be rejected
+        anymore, such as the later parts of a streamed response
+        """
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        slots = self._slots
+
+        # locked while calls wait for a slot too, so they are not overtaken
+        if slots.locked() and not wait:
+            self._rejected.inc()
+            raise ExecutorSaturated(self.name)
+
+        await slots.acquire()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(_timed, fn, *args)
+            if self.kind == "thread":
+                # so spans recorded by fn belong to the profile of the caller
+                call = functools.partial(contextvars.copy_context().run, call)
+
+            submitted = time.monotonic()
+            started, result = await loop.run_in_executor(self.executor, call)
+            self._wait.observe(started - submitted)
+            return result
+        finally:
+            self._pending -= 1
+            slots.release()
+
+    def shutdown(self, wait: bool = False) -> None:
+        """cancels the pending calls, wait joins the workers once they finished"""
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+        self._slots = None
+
+
+inference_executor = BoundedExecutor(
+    "inference",
+    kind=settings.INFERENCE_EXECUTOR,
+    workers=settings.INFERENCE_WORKERS,
+    max_pending=settings.INFERENCE_MAX_PENDING,
+)
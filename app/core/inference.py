@@ -0,0 +1,97 @@
+"""
+Model inference functions
+
+plain functions taking picklable arguments, so they can run on a thread or a process pool,
+their latency is recorded by the caller as process pool workers report no metrics
+"""
+
+from collections.abc import Hashable
+
+from app.core.cache import model_cache
+from app.core.lazy import lazy_import
+from app.core.metrics import Histogram
+
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+INFERENCE_SECONDS = Histogram(
+    "semiml_inference_seconds",
+    "time to score one batch of rows, waiting for a worker included",
+    labelnames=("experiment",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+INFERENCE_BATCH_ROWS = Histogram(
+    "semiml_inference_batch_rows",
+    "rows scored by one predict call",
+    labelnames=("experiment",),
+    buckets=(1, 4, 16, 64, 256, 1024, 4096, 16384, 65536),
+)
+
+
+class SchemaError(ValueError):
+    """raised when inputs do not have the shape of the training data"""
+
+
+def record_inference(key: Hashable, rows: int, seconds: float) -> None:
+    """records one predict call of a model"""
+    INFERENCE_SECONDS.labels(key).observe(seconds)
+    INFERENCE_BATCH_ROWS.labels(key).observe(rows)
+
+
+def forget_inference(key: Hashable) -> None:
+    """drops the inference metrics of a model that no longer serves predictions"""
+    INFERENCE_SECONDS.remove(key)
+    INFERENCE_BATCH_ROWS.remove(key)
+
+
+def predict_rows(
+    key: Hashable, model_path: str, rows: list[list[int | float | str]]
+) -> list[str]:
+    """scores rows of the same width with one predict call
+
+    the values of a row are in the order of the training columns, they are named after
+    them so the model sees the same features it was fitted on
+    """
+
+    if not rows:
+        raise ValueError("no inputs to score")
+
+    if len({len(row) for row in rows}) > 1:
+        raise ValueError("rows must all have the same length")
+
+    model = model_cache.get(key, model_path)
+
+    feature_names = getattr(model, "feature_names_in_", None)
+    if feature_names is None:
+        return [f"{r}" for r in model.predict(np.array(rows))]
+
+    if len(rows[0]) != len(feature_names):
+        raise SchemaError(f"rows must have {len(feature_names)} values")
+
+    data = pd.DataFrame(rows, columns=list(feature_names))
+    return [f"{r}" for r in model.predict(data)]
+
+
+def predict_columns(
+    key: Hashable,
+    model_path: str,
+    columns: "dict[str, list[int | float | str]] | pd.DataFrame",
+) -> list[str]:
+    """scores named columns with one predict call, ordering them like the training data"""
+
+    model = model_cache.get(key, model_path)
+
+    data = pd.DataFrame(columns)
+    feature_names = getattr(model, "feature_names_in_", None)
+    if feature_names is not None:
+        missing = [col for col in feature_names if col not in data.columns]
+        if missing:
+            raise SchemaError(f"missing columns: {', '.join(missing)}")
+        data = data[list(feature_names)]
+
+    if data.shape[0] == 0:
+        raise ValueError("no inputs to score")
+
+    return [f"{r}" for r in model.predict(data)]
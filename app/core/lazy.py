@@ -0,0 +1,59 @@
+"""
+Lazily imported modules
+
+pandas, numpy, pyarrow, sklearn and joblib take seconds to import, they are bound to
+module proxies imported on first attribute access, so a worker serves requests that do
+not need them, such as logins, as soon as it starts, and prewarm imports them in the
+background right after startup
+"""
+
+import importlib
+import threading
+from types import ModuleType
+from typing import Any
+
+
+HEAVY_MODULES = (
+    "numpy",
+    "pandas",
+    "pyarrow.parquet",
+    "joblib",
+    "sklearn.ensemble",
+    "sklearn.preprocessing",
+)
+
+
+class LazyModule(ModuleType):
+    """module imported on first attribute access
+
+    the attributes of the module are copied onto the proxy once it is imported, so
+    later lookups cost the same as on the module itself
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+
+    def __getattr__(self, attr: str) -> Any:
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> Any:
+    """proxy of a module, imported when one of its attributes is first read"""
+    return LazyModule(name)
+
+
+def _import_all(names: tuple[str, ...]) -> None:
+    for name in names:
+        importlib.import_module(name)
+
+
+def prewarm(names: tuple[str, ...] = HEAVY_MODULES) -> threading.Thread:
+    """imports modules in a background thread, ahead of the first request using them"""
+
+    thread = threading.Thread(
+        target=_import_all, args=(names,), name="prewarm-imports", daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,293 @@
+"""
+In-process application metrics
+
+counters, gauges and histograms kept in plain python objects and rendered
+in the Prometheus text exposition format, the renderings of several processes
+can be merged into one, labelled by process
+"""
+
+from bisect import bisect_left
+from collections.abc import Callable, Sequence
+
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_value(value: float) -> str:
+    """formats a sample value the way Prometheus expects it"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """formats label pairs as {name="value",...}"""
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    """escapes backslashes, quotes and newlines in a label value"""
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Callable[[], float] | None = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """reads the gauge value from a callable at collection time"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    """base class for a metric family with optional labels"""
+
+    _type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: "Registry | None" = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: object):
+        """returns the child metric for the given label values"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, *values: object) -> None:
+        """drops the child metric for the given label values"""
+        self._children.pop(tuple(str(value) for value in values), None)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self._type}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """monotonically increasing value"""
+
+    _type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    @property
+    def value(self) -> float:
+        return self._children[()].value
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in list(self._children.items())
+        ]
+
+
+class Gauge(_Metric):
+    """value that can go up and down"""
+
+    _type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._children[()].dec(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._children[()].set_function(function)
+
+    @property
+    def value(self) -> float:
+        return self._children[()].get()
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"
+            for key, child in list(self._children.items())
+        ]
+
+
+class Histogram(_Metric):
+    """distribution of observed values over fixed buckets"""
+
+    _type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: "Registry | None" = None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                labels = _format_labels(
+                    (*self.labelnames, "le"), (*key, _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """collection of metrics exposed together"""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _add_label(sample: str, name: str, value: str) -> str:
+    """adds a label to a sample line of the exposition format"""
+
+    metric, brace, rest = sample.partition("{")
+    label = f'{name}="{_escape(value)}"'
+    if brace:
+        return f"{metric}{{{label},{rest}"
+
+    metric, _, number = sample.rpartition(" ")
+    return f"{metric}{{{label}}} {number}"
+
+
+def merge_expositions(expositions: dict[str, str], label: str) -> str:
+    """merges the renderings of registries, their samples labelled by their key
+
+    every metric family is written once, with the samples of every rendering
+    """
+
+    families: dict[str, list[str]] = {}
+    for key, text in expositions.items():
+        lines: list[str] = []
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                lines = families.setdefault(line.split(" ", 3)[2], [line])
+            elif line.startswith("# TYPE "):
+                if len(lines) == 1:
+                    lines.append(line)
+            elif line:
+                lines.append(_add_label(line, label, key))
+
+    return "\n".join("\n".join(lines) for lines in families.values()) + "\n"
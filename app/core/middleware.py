@@ -0,0 +1,70 @@
+"""
+ASGI middlewares
+
+plain ASGI callables rather than BaseHTTPMiddleware, so they add no task or body copy
+to the requests they wrap, streamed responses included
+"""
+
+import time
+from contextvars import ContextVar
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.metrics import Gauge, Histogram
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "semiml_http_request_duration_seconds",
+    "time to serve a request, until its response is sent",
+    labelnames=("method", "route", "status"),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "semiml_http_requests_in_flight", "requests being served"
+)
+
+# scope of the request served by the current task, read by the event loop watchdog
+current_request: ContextVar[Scope | None] = ContextVar("current_request", default=None)
+
+
+def describe_request(scope: Scope) -> str:
+    """method and route template of a request, or its path until it is routed"""
+
+    route = getattr(scope.get("route"), "path", None)
+    return f"{scope['method']} {route or scope['path']}"
+
+
+class MetricsMiddleware:
+    """records the latency of every request by method, route template and status
+
+    the route template is set in the scope by the router, requests matching no route
+    are recorded under "unmatched" so unknown paths do not add series
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        token = current_request.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_DURATION.labels(scope["method"], route, status_code).observe(
+                time.perf_counter() - started
+            )
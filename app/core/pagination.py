@@ -0,0 +1,92 @@
+"""
+Keyset pagination of listings
+
+listings are ordered by (date, id) and a page starts after the key of the last row of
+the previous one, so every page costs one index range scan whatever its position
+"""
+
+import base64
+import uuid
+from datetime import datetime
+from typing import Literal
+
+from fastapi import Request
+from sqlalchemy import Select, tuple_
+
+
+Order = Literal["asc", "desc"]
+
+
+def encode_cursor(date: datetime, id: uuid.UUID) -> str:
+    """opaque cursor of a row, the page after it starts at the next row"""
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """key of the row a cursor points at, raises ValueError on a malformed cursor"""
+
+    try:
+        date, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(date), uuid.UUID(id)
+    except (UnicodeError, ValueError, TypeError):
+        raise ValueError("malformed cursor")
+
+
+def naive(date: datetime) -> datetime:
+    """date in the local time of the server without its offset, like the stored dates
+
+    rows are dated with datetime.now, so an offset given in a query is converted to
+    that time rather than compared with the naive columns, which the database refuses
+    """
+
+    if date.tzinfo is None:
+        return date
+    return date.astimezone().replace(tzinfo=None)
+
+
+def paginate(
+    statement: Select,
+    model,
+    cursor: str | None,
+    order: Order,
+    limit: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Select:
+    """restricts a select of model to one page of rows between since and until
+
+    one row more than limit is selected to tell whether another page follows
+    """
+
+    key = tuple_(model.date, model.id)
+
+    if since is not None:
+        statement = statement.where(model.date >= naive(since))
+    if until is not None:
+        statement = statement.where(model.date < naive(until))
+
+    if cursor is not None:
+        after = tuple_(*decode_cursor(cursor))
+        statement = statement.where(key < after if order == "desc" else key > after)
+
+    if order == "desc":
+        statement = statement.order_by(model.date.desc(), model.id.desc())
+    else:
+        statement = statement.order_by(model.date.asc(), model.id.asc())
+
+    return statement.limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> tuple[list, str | None]:
+    """splits the rows selected by paginate into the page and the next cursor"""
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].date, rows[-1].id)
+
+
+def next_link(request: Request, cursor: str) -> str:
+    """Link header pointing at the page after cursor"""
+    return f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"'
@@ -0,0 +1,210 @@
+"""
+Opt-in profiling of requests
+
+a request is profiled when a superuser asks for it with the X-Profile header, or when it
+is drawn at PROFILE_SAMPLE_RATE, the stacks of the process are sampled while it runs and
+named spans are recorded around its phases
+
+every profile is written to PROFILE_TARGET as collapsed stacks (<id>.folded), read by
+flamegraph.pl, inferno and speedscope, and as a chrome trace of its spans
+(<id>.trace.json), read by perfetto and chrome://tracing
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from collections.abc import Awaitable, Callable, Iterator
+from contextvars import ContextVar
+from types import FrameType
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+
+PROFILE_HEADER = "x-profile"
+
+
+class Profile:
+    """spans and sampled stacks of one request"""
+
+    def __init__(self, name: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.started = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.spans: list[tuple[str, float, float, int]] = []
+        self.stacks: Counter[str] = Counter()
+
+    def add_span(self, name: str, start: float, end: float) -> None:
+        # list appends are atomic, spans may be recorded from worker threads
+        self.spans.append((name, start, end, threading.get_ident()))
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def trace(self, status: int) -> dict:
+        pid = os.getpid()
+        end = time.perf_counter()
+        events = [
+            {
+                "name": self.name,
+                "ph": "X",
+                "ts": 0,
+                "dur": (end - self.started) * 1e6,
+                "pid": pid,
+                "tid": self.thread,
+                "args": {"status": status},
+            }
+        ]
+        events.extend(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.started) * 1e6,
+                "dur": (stop - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, stop, tid in self.spans
+        )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, directory: str, status: int) -> None:
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        with open(base + ".folded", "w") as f:
+            f.write(self.folded())
+        with open(base + ".trace.json", "w") as f:
+            json.dump(self.trace(status), f)
+
+
+_profile: ContextVar[Profile | None] = ContextVar("profile", default=None)
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """records the time spent in a block when the current request is profiled"""
+
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, time.perf_counter())
+
+
+def _fold(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}.{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """samples the stacks of every thread of the process into a profile
+
+    threads idle in a threading wait, such as unused pool workers, are left out, as the
+    event loop and the pools also run other requests their stacks are included too
+    """
+
+    def __init__(self, profile: Profile, interval: float):
+        self.profile = profile
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True
+        )
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_filename == threading.__file__:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                    name = names.get(ident, str(ident))
+                self.profile.stacks[f"{name};{_fold(frame)}"] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class ProfilingMiddleware:
+    """profiles requests asked for by a superuser or drawn at the sample rate
+
+    authorize receives the bearer token of a request carrying the X-Profile header and
+    tells whether it belongs to a superuser, one request is profiled at a time and its
+    profile id is sent back in the X-Profile-Id header
+    """
+
+    def __init__(self, app: ASGIApp, authorize: Callable[[str], Awaitable[bool]]):
+        self.app = app
+        self.authorize = authorize
+        self._active = False
+
+    async def _requested(self, scope: Scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(PROFILE_HEADER.encode()) is None:
+            rate = settings.PROFILE_SAMPLE_RATE
+            return rate > 0 and random.random() < rate
+
+        scheme, _, token = headers.get(b"authorization", b"").decode().partition(" ")
+        return scheme.lower() == "bearer" and await self.authorize(token)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or self._active
+            or not await self._requested(scope)
+            or self._active
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(f"{scope['method']} {scope['path']}")
+        status_code = 500
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-profile-id", profile.id.encode()),
+                ]
+            await send(message)
+
+        self._active = True
+        sampler = StackSampler(profile, settings.PROFILE_INTERVAL_MS / 1000)
+        token = _profile.set(profile)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop()
+            _profile.reset(token)
+            self._active = False
+            await asyncio.to_thread(
+                profile.write, settings.PROFILE_TARGET, status_code
+            )
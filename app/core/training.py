@@ -0,0 +1,358 @@
+"""
+Training job scheduler
+
+runs experiment training in a pool of worker processes, so fitting a model never blocks
+the API event loop, and persists the state of every job in the training_jobs table, jobs
+are only tracked in memory by the process running them, so a job still running when that
+process starts again was interrupted and is marked failed, queued jobs are run again
+
+under app.serve the workers only queue jobs, a single trainer process runs the jobs of
+every worker, so the limits of the settings hold for the whole server
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+
+import aiofiles.os
+from sqlalchemy import select, update
+from sqlalchemy.exc import DBAPIError, NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.exc import StaleDataError
+
+from app.core.config import settings
+from app.core.datasets import load_dataset
+from app.core.db import async_session_maker
+from app.core.lazy import lazy_import
+from app.core.metrics import Counter, Gauge, Histogram
+from app.models.experiments import Experiment
+from app.models.files import File
+from app.models.jobs import TrainingJob
+
+joblib = lazy_import("joblib")
+ensemble = lazy_import("sklearn.ensemble")
+preprocessing = lazy_import("sklearn.preprocessing")
+
+
+TRAINING_JOBS_QUEUED = Gauge(
+    "semiml_training_jobs_queued", "training jobs waiting for a worker"
+)
+TRAINING_JOBS_RUNNING = Gauge("semiml_training_jobs_running", "training jobs running")
+TRAINING_CORES_IN_USE = Gauge(
+    "semiml_training_cores_in_use", "cores budgeted to running training jobs"
+)
+TRAINING_JOBS = Counter(
+    "semiml_training_jobs_total", "training jobs finished", labelnames=("status",)
+)
+TRAINING_DURATION = Histogram(
+    "semiml_training_duration_seconds",
+    "time to load the data, fit and save a model, in the worker",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+)
+TRAINING_ROWS_PER_SECOND = Histogram(
+    "semiml_training_rows_per_second",
+    "training rows processed per second of training",
+    buckets=(1e2, 1e3, 5e3, 1e4, 5e4, 1e5, 5e5, 1e6),
+)
+
+
+MODEL_TARGET = str(settings.MODEL_TARGET)
+
+
+def model_path(experiment_id: uuid.UUID) -> str:
+    """path the model of an experiment is saved at"""
+    return MODEL_TARGET + str(experiment_id) + ".pkl"
+
+
+class TrainedModel(NamedTuple):
+    schema: str
+    rows: int
+    seconds: float
+
+
+def train_model(
+    data_path: str, target_col: str, model_path: str, n_jobs: int = 1
+) -> TrainedModel:
+    """fits a model on a csv file using n_jobs cores and saves it
+
+    runs inside a worker process, returns the model schema with the number of rows it
+    was trained on and the time it took
+    """
+
+    started = time.perf_counter()
+    data = load_dataset(data_path)
+
+    schema = "Input: "
+
+    X = data.drop(columns=[target_col])
+    y = data[target_col]
+
+    schema += ", ".join([f"{col} ({X[col].dtype})" for col in X.columns])
+
+    label_encoder = preprocessing.LabelEncoder()
+    y_encoded = label_encoder.fit_transform(y)
+
+    schema += " Output: "
+    schema += ", ".join(
+        [f"{label}={index}" for index, label in enumerate(label_encoder.classes_)]
+    )
+
+    model = ensemble.RandomForestClassifier(n_jobs=n_jobs)
+    model.fit(X, y_encoded)
+
+    # single-row predictions are slower when spread over threads
+    model.set_params(n_jobs=None)
+    joblib.dump(model, model_path, compress=settings.MODEL_COMPRESSION_LEVEL)
+
+    return TrainedModel(schema, len(data), time.perf_counter() - started)
+
+
+class TrainingScheduler:
+    """queues training jobs and runs at most max_concurrent of them at a time
+
+    a job gets its cores when it starts and keeps them for its whole life, a job
+    starting alone gets every free core but one for each other job that could still
+    start, and jobs starting together share the free cores, so one big job uses most
+    of the machine and the running jobs never use more than max_cores together, given
+    at least one core per job
+    """
+
+    def __init__(self, max_concurrent: int, max_cores: int):
+        self.max_concurrent = max_concurrent
+        self.max_cores = max_cores
+        self._executor: ProcessPoolExecutor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._submitted: set[uuid.UUID] = set()
+        self._closing = False
+        # set in processes leaving their jobs queued for another process to run
+        self.delegated = False
+        self.queued = 0
+        self.running = 0
+        self.cores_in_use = 0
+
+    def core_budget(self) -> int:
+        """cores of the next job to start, given the running and the queued jobs"""
+
+        free = self.max_cores - self.cores_in_use
+        idle = self.max_concurrent - self.running
+        starting = max(1, min(self.queued + 1, idle))
+        # one core is kept for every job that could start later
+        return max(1, (free - (idle - starting)) // starting)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_concurrent,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        """fails the jobs left running by a previous process and runs the queued ones"""
+
+        if self.delegated:
+            return
+
+        self._closing = False
+        try:
+            async with async_session_maker() as session:
+                interrupted = await session.execute(
+                    update(TrainingJob)
+                    .where(TrainingJob.status == "running")
+                    .values(
+                        status="failed",
+                        error="interrupted by a restart",
+                        finished=datetime.now(),
+                    )
+                )
+                queued = list(
+                    await session.scalars(
+                        select(TrainingJob.id)
+                        .where(TrainingJob.status == "queued")
+                        .order_by(TrainingJob.date)
+                    )
+                )
+                await session.commit()
+        except (OSError, DBAPIError) as e:
+            print(f"Could not resume training jobs: {e}", file=sys.stderr)
+            return
+
+        if interrupted.rowcount:
+            TRAINING_JOBS.labels("failed").inc(interrupted.rowcount)
+        for job_id in queued:
+            self.submit(job_id)
+
+    async def poll(self) -> None:
+        """runs the jobs queued by other processes"""
+
+        try:
+            async with async_session_maker() as session:
+                queued = list(
+                    await session.scalars(
+                        select(TrainingJob.id)
+                        .where(TrainingJob.status == "queued")
+                        .order_by(TrainingJob.date)
+                    )
+                )
+        except (OSError, DBAPIError) as e:
+            print(f"Could not look for training jobs: {e}", file=sys.stderr)
+            return
+
+        for job_id in queued:
+            self.submit(job_id)
+
+    def submit(self, job_id: uuid.UUID) -> None:
+        """schedules a queued job to run as soon as a worker is free"""
+
+        if self.delegated or job_id in self._submitted:
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        self._submitted.add(job_id)
+        # counted now, so jobs submitted together share the cores when they start
+        self.queued += 1
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job_id: uuid.UUID) -> None:
+        try:
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.queued -= 1
+
+            n_jobs = self.core_budget()
+            self.running += 1
+            self.cores_in_use += n_jobs
+            try:
+                if not self._closing:
+                    await self._train(job_id, n_jobs)
+            finally:
+                self.running -= 1
+                self.cores_in_use -= n_jobs
+                self._semaphore.release()
+        finally:
+            self._submitted.discard(job_id)
+
+    async def _train(self, job_id: uuid.UUID, n_jobs: int) -> None:
+        async with async_session_maker() as session:
+            job = await session.get(TrainingJob, job_id)
+            if job is None or job.status != "queued":
+                return
+
+            experiment = await session.get(Experiment, job.experiment_id)
+            if experiment is None:
+                await self._fail(session, job, "the experiment was deleted")
+                return
+
+            file = await session.get(File, experiment.file_id)
+            if file is None:
+                await self._fail(session, job, "the file of the experiment was deleted")
+                return
+
+            path = model_path(experiment.id)
+            setattr(job, "status", "running")
+            setattr(job, "started", datetime.now())
+            await session.commit()
+
+            loop = asyncio.get_running_loop()
+            try:
+                trained = await loop.run_in_executor(
+                    self.executor,
+                    train_model,
+                    file.path,
+                    experiment.target_col,
+                    path,
+                    n_jobs,
+                )
+            except asyncio.CancelledError:
+                await self._fail(session, job, "interrupted by a shutdown")
+                raise
+            except Exception as e:
+                await self._fail(session, job, f"{type(e).__name__}: {e}")
+                return
+
+            TRAINING_DURATION.observe(trained.seconds)
+            if trained.seconds > 0:
+                TRAINING_ROWS_PER_SECOND.observe(trained.rows / trained.seconds)
+
+            try:
+                # read again, the instance of the session is kept from before training
+                experiment = await session.get(
+                    Experiment, job.experiment_id, populate_existing=True
+                )
+                if experiment is None:
+                    raise NoResultFound()
+
+                setattr(experiment, "model_path", path)
+                setattr(experiment, "model_schema", trained.schema)
+
+                setattr(job, "status", "succeeded")
+                setattr(job, "finished", datetime.now())
+                await session.commit()
+            except (NoResultFound, StaleDataError):
+                # the experiment was deleted while its model was training
+                await session.rollback()
+                with contextlib.suppress(FileNotFoundError):
+                    await aiofiles.os.remove(path)
+                await self._fail(
+                    session, job, "the experiment was deleted while training"
+                )
+                return
+
+            TRAINING_JOBS.labels("succeeded").inc()
+
+    async def _fail(self, session: AsyncSession, job: TrainingJob, error: str) -> None:
+        """marks a job failed, unless it was deleted along with its experiment"""
+
+        TRAINING_JOBS.labels("failed").inc()
+        setattr(job, "status", "failed")
+        setattr(job, "error", error)
+        setattr(job, "finished", datetime.now())
+        try:
+            await session.commit()
+        except StaleDataError:
+            await session.rollback()
+
+    async def shutdown(self, timeout: float = 0.0, wait: bool = False) -> None:
+        """waits up to timeout seconds for the running jobs, then cancels every job
+
+        cancelled jobs that were running are marked failed, queued jobs stay queued
+        and run on the next start, no job starts once the shutdown began, wait joins
+        the training processes before returning
+        """
+
+        self._closing = True
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        # tasks cancelled before they started never left the queue
+        self.queued = 0
+        self._submitted.clear()
+
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=wait, cancel_futures=True)
+        self._semaphore = None
+
+
+training_scheduler = TrainingScheduler(
+    settings.TRAINING_MAX_CONCURRENT, settings.TRAINING_MAX_CORES
+)
+
+TRAINING_JOBS_QUEUED.set_function(lambda: training_scheduler.queued)
+TRAINING_JOBS_RUNNING.set_function(lambda: training_scheduler.running)
+TRAINING_CORES_IN_USE.set_function(lambda: training_scheduler.cores_in_use)
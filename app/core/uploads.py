@@ -0,0 +1,355 @@
+"""
+Streaming validation and storage of uploaded csv files
+
+uploads are copied to disk in large chunks and checked from their first chunk, so the
+memory held per upload is bounded by the chunk size whatever the file size, and they are
+stored compressed under the hash of their content so identical uploads share their bytes
+"""
+
+import asyncio
+import codecs
+import csv
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections.abc import AsyncIterator, Awaitable, Callable
+from itertools import islice
+from typing import NamedTuple
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+
+from app.core.compression import dataset_compressor
+from app.core.config import settings
+from app.core.metrics import Counter, Histogram
+
+UPLOAD_BYTES = Counter("semiml_upload_bytes_total", "bytes received in uploads")
+UPLOAD_THROUGHPUT = Histogram(
+    "semiml_upload_bytes_per_second",
+    "transfer rate of each upload or upload part, storage included",
+    buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8, 1e9),
+)
+
+
+def _record_upload(size: int, started: float) -> None:
+    UPLOAD_BYTES.inc(size)
+    elapsed = time.perf_counter() - started
+    if elapsed > 0:
+        UPLOAD_THROUGHPUT.observe(size / elapsed)
+
+
+class InvalidCsv(ValueError):
+    """raised when an upload is not a well-formed csv file"""
+
+
+class UploadTooLarge(ValueError):
+    """raised when an upload exceeds UPLOAD_MAX_BYTES"""
+
+
+class CsvFormat(NamedTuple):
+    encoding: str
+    delimiter: str
+
+
+# tried in order on files without a BOM, latin-1 decodes any bytes
+FALLBACK_ENCODINGS = ("utf-8", "cp1252", "latin-1")
+
+
+def decode_head(head: bytes, complete: bool) -> tuple[str, str]:
+    """detects the encoding of the first bytes of a file and decodes them
+
+    a BOM tells UTF-8 or UTF-16, files without one are UTF-8 unless they do not decode
+    as such, they are then taken for the single-byte encodings of FALLBACK_ENCODINGS
+    """
+
+    if head.startswith(codecs.BOM_UTF8):
+        encodings = ("utf-8-sig",)
+    elif head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encodings = ("utf-16",)
+    else:
+        encodings = FALLBACK_ENCODINGS
+
+    for encoding in encodings:
+        try:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            return encoding, decoder.decode(head, final=complete)
+        except UnicodeDecodeError:
+            continue
+
+    raise InvalidCsv(f"file is not valid {encodings[0]}")
+
+
+def sniff_csv(head: bytes, complete: bool) -> CsvFormat:
+    """detects the encoding and delimiter of a csv file from its first bytes
+
+    checks that the first CSV_CHECK_ROWS rows of the sample have as many fields as the
+    header, complete tells whether head holds the whole file
+    """
+
+    if not head.strip():
+        raise InvalidCsv("empty csv file")
+
+    encoding, text = decode_head(head, complete)
+
+    if not complete:
+        # the last line of a partial sample may be cut in the middle
+        text = text[: text.rfind("\n") + 1]
+
+    try:
+        delimiter = csv.Sniffer().sniff(text[:65536], delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
+    header = next(reader, None)
+    if not header or not any(col.strip() for col in header):
+        raise InvalidCsv("missing header row")
+
+    n_rows = 0
+    for n_rows, row in enumerate(islice(reader, settings.CSV_CHECK_ROWS), start=1):
+        # blank lines are skipped by the parser
+        if row and len(row) != len(header):
+            raise InvalidCsv(
+                f"row {n_rows + 1} has {len(row)} fields, the header has {len(header)}"
+            )
+
+    if complete and n_rows == 0:
+        raise InvalidCsv("empty csv file")
+
+    return CsvFormat(encoding, delimiter)
+
+
+async def check_upload(file: UploadFile) -> CsvFormat:
+    """validates an upload from its size and first chunk, leaving it rewound"""
+
+    if file.size is not None and file.size > settings.UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"files are limited to {settings.UPLOAD_MAX_BYTES} bytes")
+
+    head = await file.read(settings.UPLOAD_CHUNK_BYTES)
+    await file.seek(0)
+
+    return sniff_csv(head, complete=len(head) < settings.UPLOAD_CHUNK_BYTES)
+
+
+class SavedUpload(NamedTuple):
+    path: str
+    content_hash: str
+    csv_format: CsvFormat
+
+
+async def _store(
+    read_chunks: Callable[[], AsyncIterator[bytes]],
+    directory: str,
+    compress: bool = True,
+    on_hash: Callable[[str], Awaitable[None]] | None = None,
+) -> tuple[str, str]:
+    """stores the chunks yielded by read_chunks into directory under their content hash
+
+    the chunks are read once to hash them, and read again to be compressed into a
+    temporary file renamed into place only when no content with this hash is stored
+    yet, on_hash is awaited with the path before it is looked up, to lock it
+    """
+
+    compressor = dataset_compressor(compress)
+    digest = hashlib.sha256()
+    size = 0
+    started = time.perf_counter()
+    async for content in read_chunks():
+        size += len(content)
+        if size > settings.UPLOAD_MAX_BYTES:
+            raise UploadTooLarge(
+                f"files are limited to {settings.UPLOAD_MAX_BYTES} bytes"
+            )
+        digest.update(content)
+
+    content_hash = digest.hexdigest()
+    path = os.path.join(directory, content_hash + ".csv" + compressor.suffix)
+    if on_hash is not None:
+        await on_hash(path)
+
+    if not await aiofiles.os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        digest = hashlib.sha256()
+        try:
+            async with aiofiles.open(fd, "wb") as f:
+                async for content in read_chunks():
+                    digest.update(content)
+                    if compressor.enabled:
+                        content = await asyncio.to_thread(compressor.compress, content)
+                    await f.write(content)
+                await f.write(compressor.flush())
+
+            # bytes stored under another hash would be served to every file sharing it
+            if digest.hexdigest() != content_hash:
+                raise InvalidCsv("file changed while it was stored")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    _record_upload(size, started)
+    return path, content_hash
+
+
+async def save_upload(
+    file: UploadFile,
+    directory: str,
+    compress: bool = True,
+    on_hash: Callable[[str], Awaitable[None]] | None = None,
+) -> SavedUpload:
+    """streams a validated upload into directory, stored under its content hash
+
+    compress=False keeps the file as uploaded, for files only read once
+    """
+
+    csv_format = await check_upload(file)
+
+    async def chunks() -> AsyncIterator[bytes]:
+        await file.seek(0)
+        while content := await file.read(settings.UPLOAD_CHUNK_BYTES):
+            yield content
+
+    path, content_hash = await _store(chunks, directory, compress, on_hash)
+    return SavedUpload(path, content_hash, csv_format)
+
+
+class PartError(ValueError):
+    """raised when a part of a resumable upload does not have its expected size"""
+
+
+def session_directory(session_id: uuid.UUID) -> str:
+    """directory holding the received parts of a resumable upload"""
+    return os.path.join(settings.UPLOAD_TARGET, "sessions", str(session_id))
+
+
+def n_parts(size: int, part_bytes: int) -> int:
+    """number of parts a resumable upload of size bytes is split into"""
+    return -(-size // part_bytes)
+
+
+def part_size(size: int, part_bytes: int, number: int) -> int:
+    """expected size of a part, every part is part_bytes long but the last one"""
+    return min(part_bytes, size - number * part_bytes)
+
+
+def remove_session_directories(
+    live: set[uuid.UUID], expired: set[uuid.UUID], cutoff: float
+) -> None:
+    """removes the part directories of expired upload sessions
+
+    directories left by sessions that are not live anymore are removed too, once they
+    were not written since cutoff, a timestamp
+    """
+
+    root = os.path.join(settings.UPLOAD_TARGET, "sessions")
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        try:
+            session_id = uuid.UUID(name)
+        except ValueError:
+            continue
+        if session_id in live:
+            continue
+
+        directory = os.path.join(root, name)
+        try:
+            if session_id in expired or os.stat(directory).st_mtime < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def received_parts(directory: str) -> list[int]:
+    """numbers of the parts of a resumable upload written so far, in order"""
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    return sorted(int(name[:-5]) for name in names if name.endswith(".part"))
+
+
+async def save_part(
+    chunks: AsyncIterator[bytes],
+    directory: str,
+    number: int,
+    size: int,
+    part_bytes: int,
+) -> None:
+    """streams one part of a resumable upload into directory
+
+    the part is written aside and renamed once complete, so a dropped or retried
+    transfer never leaves a partial part behind, the first part is checked like the
+    head of a whole upload
+    """
+
+    if not 0 <= number < n_parts(size, part_bytes):
+        raise PartError(f"part {number} is out of range")
+    expected = part_size(size, part_bytes, number)
+
+    await aiofiles.os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".part-")
+    received = 0
+    started = time.perf_counter()
+    try:
+        async with aiofiles.open(fd, "wb") as f:
+            async for content in chunks:
+                received += len(content)
+                if received > expected:
+                    break
+                await f.write(content)
+
+        if received != expected:
+            raise PartError(f"part {number} must be {expected} bytes")
+
+        if number == 0:
+            # the first part holds the whole file only when it is the only part
+            await _check_head(tmp_path, complete=n_parts(size, part_bytes) == 1)
+
+        os.replace(tmp_path, os.path.join(directory, f"{number}.part"))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    _record_upload(received, started)
+
+
+async def _check_head(path: str, complete: bool) -> CsvFormat:
+    async with aiofiles.open(path, "rb") as f:
+        head = await f.read(settings.UPLOAD_CHUNK_BYTES)
+
+    return sniff_csv(
+        head, complete=complete and len(head) < settings.UPLOAD_CHUNK_BYTES
+    )
+
+
+async def assemble_parts(
+    directory: str,
+    count: int,
+    target: str,
+    on_hash: Callable[[str], Awaitable[None]] | None = None,
+) -> SavedUpload:
+    """joins the parts of a resumable upload into target, stored under its content hash"""
+
+    paths = [os.path.join(directory, f"{number}.part") for number in range(count)]
+    csv_format = await _check_head(paths[0], complete=count == 1)
+
+    async def chunks() -> AsyncIterator[bytes]:
+        for path in paths:
+            async with aiofiles.open(path, "rb") as f:
+                while content := await f.read(settings.UPLOAD_CHUNK_BYTES):
+                    yield content
+
+    path, content_hash = await _store(chunks, target, on_hash=on_hash)
+    return SavedUpload(path, content_hash, csv_format)
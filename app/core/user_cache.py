@@ -0,0 +1,102 @@
+"""
+In-process cache of authenticated users
+
+keeps the users resolved from access tokens for a few seconds, so authenticated
+requests do not query the users table every time
+"""
+
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge
+
+
+USER_CACHE_HITS = Counter("semiml_user_cache_hits_total", "user cache hits")
+USER_CACHE_MISSES = Counter("semiml_user_cache_misses_total", "user cache misses")
+USER_CACHE_INVALIDATIONS = Counter(
+    "semiml_user_cache_invalidations_total", "users dropped from the cache on change"
+)
+USER_CACHE_ENTRIES = Gauge("semiml_user_cache_entries", "users held by the cache")
+USER_CACHE_HIT_RATIO = Gauge(
+    "semiml_user_cache_hit_ratio", "share of user lookups served from the cache"
+)
+
+
+def detached_copy(instance: Any) -> Any:
+    """detached copy of the column attributes of an orm instance
+
+    the copy belongs to no session, so it can be shared between requests and merged
+    into each of their sessions without a query
+    """
+
+    mapper = inspect(instance).mapper
+    copy = mapper.class_(
+        **{attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs}
+    )
+    make_transient_to_detached(copy)
+    return copy
+
+
+class UserCache:
+    """LRU cache of users by id, entries expire ttl seconds after they are stored
+
+    only used from the event loop, a change to a user drops it in the process that made
+    it, other processes see it once the entry expires
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[uuid.UUID, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, id: uuid.UUID) -> Any | None:
+        entry = self._entries.get(id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(id)
+            self.hits += 1
+            USER_CACHE_HITS.inc()
+            return entry[1]
+
+        if entry is not None:
+            del self._entries[id]
+        self.misses += 1
+        USER_CACHE_MISSES.inc()
+        return None
+
+    def put(self, id: uuid.UUID, user: Any) -> None:
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+
+        self._entries[id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, id: uuid.UUID) -> None:
+        if self._entries.pop(id, None) is not None:
+            USER_CACHE_INVALIDATIONS.inc()
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+user_cache = UserCache(settings.USER_CACHE_MAX_SIZE, settings.USER_CACHE_TTL_SECONDS)
+
+USER_CACHE_ENTRIES.set_function(lambda: len(user_cache))
+USER_CACHE_HIT_RATIO.set_function(lambda: user_cache.hit_ratio)
@@ -0,0 +1,139 @@
+"""
+Event loop watchdog
+
+a heartbeat task measures how late the event loop wakes it up, and a thread watching
+the heartbeat logs the stack of the loop while a callback blocks it longer than
+LOOP_STALL_THRESHOLD_MS, so blocking calls are caught where they happen, along with the
+request being served
+"""
+
+import asyncio
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge, Histogram
+from app.core.middleware import current_request, describe_request
+
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram(
+    "semiml_event_loop_lag_seconds",
+    "delay of the event loop in running a scheduled wakeup",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+LOOP_LAG_QUANTILE = Gauge(
+    "semiml_event_loop_lag_quantile_seconds",
+    "event loop lag over the recent wakeups, by quantile",
+    labelnames=("quantile",),
+)
+LOOP_STALLS = Counter(
+    "semiml_event_loop_stalls_total", "callbacks blocking the event loop too long"
+)
+
+
+class LoopWatchdog:
+    """measures the lag of the running event loop every interval seconds
+
+    a stall is reported once, with the stack of the loop thread, as soon as the loop
+    has been blocked for threshold seconds
+    """
+
+    def __init__(self, interval: float, threshold: float, window: int = 1024):
+        self.interval = interval
+        self.threshold = threshold
+        self._lags: deque[float] = deque(maxlen=window)
+        self._beat = time.monotonic()
+        self._reported = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread = 0
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def quantile(self, q: float) -> float:
+        lags = sorted(self._lags)
+        if not lags:
+            return 0.0
+        return lags[min(len(lags) - 1, int(q * len(lags)))]
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag = max(0.0, self._beat - expected)
+            self._lags.append(lag)
+            LOOP_LAG.observe(lag)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(min(self.interval, self.threshold) / 2):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked > self.threshold and beat != self._reported:
+                self._reported = beat
+                self._report(blocked)
+
+    def _report(self, blocked: float) -> None:
+        LOOP_STALLS.inc()
+
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        task = asyncio.current_task(self._loop)
+        where = "a callback"
+        if task is not None:
+            where = task.get_name()
+            scope = task.get_context().get(current_request)
+            if scope is not None:
+                where = f"{describe_request(scope)} ({where})"
+
+        logger.warning(
+            "event loop blocked for %.0f ms in %s\n%s", blocked * 1000, where, stack
+        )
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+
+loop_watchdog = None
+if settings.LOOP_WATCHDOG_INTERVAL_MS > 0:
+    loop_watchdog = LoopWatchdog(
+        settings.LOOP_WATCHDOG_INTERVAL_MS / 1000,
+        settings.LOOP_STALL_THRESHOLD_MS / 1000,
+    )
+
+    for q in ("0.5", "0.9", "0.99"):
+        LOOP_LAG_QUANTILE.labels(q).set_function(
+            lambda q=float(q): loop_watchdog.quantile(q)
+        )
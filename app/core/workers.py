@@ -0,0 +1,116 @@
+"""
+Messages between preforked workers
+
+a worker changing the model of an experiment tells the master, which relays the change
+to every other worker so they drop their copy of the model and load the current one on
+their next prediction, messages are short lines written to pipes in one call, so writes
+from concurrent workers never interleave
+
+every process forked by the master also writes its metrics to a shared directory, so
+the worker answering /metrics serves the metrics of all of them
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections.abc import Callable
+
+from app.core.metrics import REGISTRY, merge_expositions
+
+
+def encode_message(experiment_id: uuid.UUID) -> bytes:
+    return f"{os.getpid()} {experiment_id}\n".encode()
+
+
+def decode_message(line: bytes) -> tuple[int, uuid.UUID]:
+    """sender pid and experiment id of a message"""
+
+    pid, experiment_id = line.decode().split()
+    return int(pid), uuid.UUID(experiment_id)
+
+
+class WorkerChannel:
+    """pipes of a worker, its messages are written to outbox, shared by every worker,
+    and the messages relayed by the master are read from inbox
+    """
+
+    def __init__(self, inbox: int, outbox: int):
+        self.inbox = inbox
+        self.outbox = outbox
+        self._buffer = b""
+
+    def start(self, on_change: Callable[[uuid.UUID], None]) -> None:
+        """calls on_change on the event loop for every model changed by another worker"""
+
+        def receive() -> None:
+            self._buffer += os.read(self.inbox, 65536)
+            *lines, self._buffer = self._buffer.split(b"\n")
+            for line in lines:
+                on_change(decode_message(line)[1])
+
+        asyncio.get_running_loop().add_reader(self.inbox, receive)
+
+    def stop(self) -> None:
+        asyncio.get_running_loop().remove_reader(self.inbox)
+
+    def publish(self, experiment_id: uuid.UUID) -> None:
+        os.write(self.outbox, encode_message(experiment_id))
+
+
+# set in the workers forked by app.serve
+channel: WorkerChannel | None = None
+
+
+def publish_model_change(experiment_id: uuid.UUID) -> None:
+    """tells the other workers the model of an experiment changed, when there are any"""
+
+    if channel is not None:
+        channel.publish(experiment_id)
+
+
+# set in the processes forked by app.serve
+metrics_directory: str | None = None
+
+
+def metrics_file(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{pid}.prom")
+
+
+def publish_metrics(directory: str, interval: float) -> None:
+    """writes the metrics of this process to directory every interval seconds"""
+
+    global metrics_directory
+    metrics_directory = directory
+    path = metrics_file(directory, os.getpid())
+
+    def publish() -> None:
+        while True:
+            # renamed into place, so readers never see a partial file
+            with open(path + ".tmp", "w") as f:
+                f.write(REGISTRY.render())
+            os.replace(path + ".tmp", path)
+            time.sleep(interval)
+
+    threading.Thread(target=publish, name="metrics-publisher", daemon=True).start()
+
+
+def collect_metrics() -> str:
+    """metrics of this process and the last ones published by the other processes,
+    labelled by the pid of their process
+    """
+
+    expositions = {str(os.getpid()): REGISTRY.render()}
+    for name in sorted(os.listdir(metrics_directory)):
+        pid, _, suffix = name.partition(".")
+        if suffix != "prom" or pid in expositions:
+            continue
+        try:
+            with open(os.path.join(metrics_directory, name)) as f:
+                expositions[pid] = f.read()
+        except FileNotFoundError:
+            # the process exited since the directory was listed
+            continue
+
+    return merge_expositions(expositions, "worker")
@@ -4,11 +4,61 @@ ASGI FastAPI application
 exposes the main ASGI application, that includes the main router
 """
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+
 from app.api.main import api_router
+from app.api.routers.experiments import release_model
+from app.core import workers
+from app.core.config import settings
+from app.core.db import dispose_engines, replica_monitor
+from app.core.executor import ExecutorSaturated, inference_executor
+from app.core.lazy import prewarm
+from app.core.middleware import MetricsMiddleware
+from app.core.profiling import ProfilingMiddleware
+from app.core.training import training_scheduler
+from app.core.watchdog import loop_watchdog
+from app.models.users import is_superuser_token
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+    if replica_monitor is not None:
+        replica_monitor.start()
+    if settings.IMPORT_PREWARM:
+        prewarm()
+    if workers.channel is not None:
+        workers.channel.start(release_model)
+    await training_scheduler.start()
+    yield
+    if workers.channel is not None:
+        workers.channel.stop()
+    if replica_monitor is not None:
+        await replica_monitor.stop()
+    if loop_watchdog is not None:
+        await loop_watchdog.stop()
+    inference_executor.shutdown()
+    await training_scheduler.shutdown(settings.TRAINING_SHUTDOWN_TIMEOUT)
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(ProfilingMiddleware, authorize=is_superuser_token)
+app.add_middleware(MetricsMiddleware)
 
 
-app = FastAPI()
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
 
 
 app.include_router(api_router)
@@ -6,7 +6,7 @@ import uuid
 from datetime import datetime
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, DateTime, UUID, ForeignKey, Boolean
+from sqlalchemy import String, DateTime, UUID, ForeignKey, Boolean, Index
 
 from app.models.base import Base
 
@@ -15,6 +15,9 @@ class Experiment(Base):
     """sqlalchemy experiments model"""
 
     __tablename__ = "experiments"
+    __table_args__ = (
+        Index("ix_experiments_user_id_date", "user_id", "date", "id"),
+    )
 
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
@@ -26,6 +29,9 @@ class Experiment(Base):
     live: Mapped[str] = mapped_column(Boolean, nullable=False, default=False)
 
     date: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    updated: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True, onupdate=datetime.now
+    )
 
     user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("user.id"), nullable=False)
     user: Mapped["User"] = relationship("User", back_populates="experiments")
@@ -6,7 +6,7 @@ import uuid
 from datetime import datetime
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, DateTime, UUID, ForeignKey
+from sqlalchemy import String, DateTime, UUID, ForeignKey, JSON, Index
 
 from app.models.base import Base
 
@@ -15,13 +15,21 @@ class File(Base):
     """sqlalchemy files model"""
 
     __tablename__ = "files"
+    __table_args__ = (Index("ix_files_user_id_date", "user_id", "date", "id"),)
 
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
     )
     title: Mapped[str] = mapped_column(String(255), nullable=False)
-    path: Mapped[str] = mapped_column(String, nullable=False)
+    path: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    content_hash: Mapped[str | None] = mapped_column(
+        String(64), nullable=True, index=True
+    )
     date: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    updated: Mapped[datetime | None] = mapped_column(
+        DateTime, nullable=True, onupdate=datetime.now
+    )
+    profile: Mapped[dict | None] = mapped_column(JSON, nullable=True)
 
     user_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("user.id"), nullable=False)
     user: Mapped["User"] = relationship("User", back_populates="files")
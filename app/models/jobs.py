@@ -0,0 +1,31 @@
+"""
+Define the training job model
+"""
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import String, DateTime, UUID, ForeignKey
+
+from app.models.base import Base
+
+
+class TrainingJob(Base):
+    """sqlalchemy training jobs model"""
+
+    __tablename__ = "training_jobs"
+
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
+    )
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")
+    error: Mapped[str] = mapped_column(String, nullable=False, default="")
+
+    date: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    started: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    experiment_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("experiments.id", ondelete="CASCADE"), nullable=False, index=True
+    )
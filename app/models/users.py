@@ -13,8 +13,10 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.models.base import Base
 from app.models.files import File
 from app.models.experiments import Experiment
-from app.core.db import get_async_session
+from app.core.db import async_session_maker, get_async_session
+from app.core.profiling import span
 from app.core.config import settings
+from app.core.user_cache import detached_copy, user_cache
 from app.schemas.users import UserRead, UserCreate, UserUpdate
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -32,6 +34,10 @@ from fastapi_users.authentication import (
     BearerTransport,
     JWTStrategy,
 )
+from fastapi_users.exceptions import InvalidID
+from fastapi_users.jwt import decode_jwt
+
+import jwt
 
 SECRET = str(settings.SECRET_KEY)
 
@@ -39,12 +45,11 @@ SECRET = str(settings.SECRET_KEY)
 class User(SQLAlchemyBaseUserTableUUID, Base):
     """sqlalchemy users model"""
 
-    files: Mapped[list[File]] = relationship(
-        "File", cascade="all, delete", lazy="selectin"
-    )
+    # loaded only when accessed, listings query files and experiments by page
+    files: Mapped[list[File]] = relationship("File", cascade="all, delete")
 
     experiments: Mapped[list[Experiment]] = relationship(
-        "Experiment", cascade="all, delete", lazy="selectin"
+        "Experiment", cascade="all, delete"
     )
 
 
@@ -91,6 +96,7 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
 
     async def on_after_verify(self, user: User, request: Request | None = None):
         """triggers on user verification"""
+        user_cache.invalidate(user.id)
         print(f"User {user.id} has been verified")
 
     async def on_after_login(
@@ -109,6 +115,7 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
         request: Request | None = None,
     ):
         """triggers on user update"""
+        user_cache.invalidate(user.id)
         print(f"User {user.id} has been updated with {update_dict}.")
 
     async def on_after_forgot_password(
@@ -119,6 +126,7 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
 
     async def on_after_reset_password(self, user: User, request: Request | None = None):
         """triggers on user reset password"""
+        user_cache.invalidate(user.id)
         print(f"User {user.id} has reset their password.")
 
     async def on_before_delete(self, user: User, request: Request | None = None):
@@ -127,6 +135,7 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
 
     async def on_after_delete(self, user: User, request: Request | None = None):
         """triggers after user delete"""
+        user_cache.invalidate(user.id)
         print(f"User {user.id} is successfully deleted")
 
 
@@ -141,9 +150,43 @@ async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db
 bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 
 
+class CachedJWTStrategy(JWTStrategy[User, uuid.UUID]):
+    """JWT strategy resolving the users of valid tokens from user_cache
+
+    the token is checked on every request, only the user lookup is cached
+    """
+
+    async def read_token(
+        self, token: str | None, user_manager: UserManager
+    ) -> User | None:
+        if token is None:
+            return None
+
+        with span("auth.read_token"):
+            return await self._read_token(token, user_manager)
+
+    async def _read_token(self, token: str, user_manager: UserManager) -> User | None:
+        try:
+            data = decode_jwt(
+                token, self.decode_key, self.token_audience, algorithms=[self.algorithm]
+            )
+            user_id = user_manager.parse_id(data["sub"])
+        except (jwt.PyJWTError, KeyError, InvalidID):
+            return None
+
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            return await user_manager.user_db.session.merge(cached, load=False)
+
+        user = await super().read_token(token, user_manager)
+        if user is not None:
+            user_cache.put(user.id, detached_copy(user))
+        return user
+
+
 def get_jwt_strategy() -> JWTStrategy:
     """JWT strategy for authentication"""
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 
 auth_backend = AuthenticationBackend(
@@ -156,3 +199,13 @@ auth_backend = AuthenticationBackend(
 fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
 current_active_user = fastapi_users.current_user(active=True)
+
+
+async def is_superuser_token(token: str) -> bool:
+    """tells whether an access token belongs to an active superuser, outside requests"""
+
+    async with async_session_maker() as session:
+        user_manager = UserManager(SQLAlchemyUserDatabase(session, User))
+        user = await get_jwt_strategy().read_token(token, user_manager)
+
+    return user is not None and user.is_active and user.is_superuser
@@ -31,3 +31,14 @@ class ExperimentCreate(ExperimentBase):
 
     file_id: str
     target_col: str
+
+
+class TrainingJobRead(BaseModel):
+    """defines the GET schema for the training job of an experiment"""
+
+    id: uuid.UUID
+    status: str
+    error: str
+    date: datetime
+    started: datetime | None
+    finished: datetime | None
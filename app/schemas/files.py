@@ -5,8 +5,9 @@ schemas to be used to interact with the files table in the database
 """
 
 import uuid
+from typing import Any
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 
 
 class FileBase(BaseModel):
@@ -20,3 +21,30 @@ class FileRead(FileBase):
     """defines the GET schema for a file instance"""
 
     id: uuid.UUID
+
+
+class ColumnProfile(BaseModel):
+    """defines the profile of one column of a file"""
+
+    name: str
+    dtype: str
+    nulls: int
+    distinct: int
+    min: float | None = None
+    max: float | None = None
+
+
+class FileProfile(BaseModel):
+    """defines the GET schema for the profile of a file"""
+
+    rows: int
+    columns: list[ColumnProfile]
+
+
+class FileRows(BaseModel):
+    """defines the GET schema for a page of rows of a file"""
+
+    offset: int
+    total: int | None
+    columns: list[str]
+    rows: list[list[Any]]
@@ -0,0 +1,36 @@
+"""
+Define resumable upload API schemas
+
+schemas to be used to interact with the upload_sessions table in the database
+"""
+
+import uuid
+from datetime import datetime
+from pydantic import BaseModel, Field
+
+
+class UploadSessionCreate(BaseModel):
+    """defines the POST schema for a resumable upload session"""
+
+    title: str = Field(max_length=255)
+    size: int = Field(gt=0, description="total size of the csv file in bytes")
+
+
+class UploadPartRead(BaseModel):
+    """defines the byte range of a received part"""
+
+    number: int
+    offset: int
+    size: int
+
+
+class UploadSessionRead(BaseModel):
+    """defines the GET schema for a resumable upload session"""
+
+    id: uuid.UUID
+    title: str
+    size: int
+    part_size: int
+    parts: int
+    received: list[UploadPartRead]
+    date: datetime
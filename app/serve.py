@@ -0,0 +1,367 @@
+"""
+Preforking server
+
+loads the application, the ML libraries and the models of every live experiment once in
+a master process, then forks workers serving one shared socket, so the workers share the
+loaded models copy-on-write instead of loading a copy each, the workers are processes
+already, so they score on threads, a process pool would load every model again, run it
+with
+
+    python -m app.serve --host 0.0.0.0 --port 80 --workers 4
+
+SIGHUP loads the live models again and replaces the workers one by one, each new worker
+is forked before its predecessor is stopped, SIGTERM and SIGINT stop the workers
+gracefully, workers exiting after SERVE_MAX_REQUESTS requests are replaced
+
+training jobs queued by the workers are run by one more forked process, the trainer,
+which is neither recycled nor replaced on SIGHUP, so replacing workers never interrupts
+a job, and the inference limits of the settings are split between the workers
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import importlib
+import os
+import random
+import selectors
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+
+import uvicorn
+from sqlalchemy import select
+
+from app.core import db, workers
+from app.core.cache import model_cache
+from app.core.config import settings
+from app.core.executor import inference_executor
+from app.core.lazy import HEAVY_MODULES
+from app.core.training import training_scheduler
+from app.core.workers import WorkerChannel, decode_message
+from app.main import app
+from app.models.experiments import Experiment
+
+SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD)
+
+
+async def live_models() -> list[tuple[uuid.UUID, str]]:
+    """models of the live experiments, the pooled connections are closed after"""
+
+    try:
+        async with db.async_session_maker() as session:
+            rows = await session.execute(
+                select(Experiment.id, Experiment.model_path).where(
+                    Experiment.live.is_(True), Experiment.model_path != ""
+                )
+            )
+            return [tuple(row) for row in rows]
+    finally:
+        # connections must not be shared with the forked workers
+        await db.dispose_engines()
+
+
+def preload() -> int:
+    """imports the ML libraries and loads the models of live experiments in the cache"""
+
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+    loaded = 0
+    if settings.SERVE_PRELOAD_MODELS:
+        model_cache.clear()
+        for experiment_id, model_path in asyncio.run(live_models()):
+            try:
+                model_cache.get(experiment_id, model_path)
+            except Exception as e:
+                print(f"Could not preload model {experiment_id}: {e}", file=sys.stderr)
+                continue
+            loaded += 1
+
+    # objects allocated so far are left alone by the collector, which would otherwise
+    # write to every one of them and copy the pages they share with the master
+    gc.freeze()
+    return loaded
+
+
+def reset_signals() -> None:
+    """restores the signal handling the master replaced, in a forked process"""
+
+    for sig in SIGNALS:
+        signal.signal(sig, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+
+
+def run_worker(
+    sock: socket.socket, channel: WorkerChannel, n_workers: int, metrics_directory: str
+) -> None:
+    """serves the app on sock until the worker is stopped or recycled"""
+
+    reset_signals()
+    random.seed()
+
+    workers.channel = channel
+    workers.publish_metrics(metrics_directory, settings.SERVE_METRICS_INTERVAL)
+
+    # jobs are left queued for the trainer, the pool of every worker gets its share
+    training_scheduler.delegated = True
+    inference_executor.kind = "thread"
+    inference_executor.workers = max(1, settings.INFERENCE_WORKERS // n_workers)
+    inference_executor.max_pending = max(1, settings.INFERENCE_MAX_PENDING // n_workers)
+
+    max_requests = None
+    if settings.SERVE_MAX_REQUESTS > 0:
+        # spread out the recycling of workers started together
+        max_requests = settings.SERVE_MAX_REQUESTS + random.randint(
+            0, settings.SERVE_MAX_REQUESTS_JITTER
+        )
+
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        limit_max_requests=max_requests,
+        timeout_graceful_shutdown=settings.SERVE_GRACEFUL_TIMEOUT,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+async def train_queued_jobs() -> None:
+    """runs the jobs queued by the workers until SIGTERM or SIGINT, then lets the
+    running ones finish within TRAINING_SHUTDOWN_TIMEOUT
+    """
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await training_scheduler.start()
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), settings.TRAINING_POLL_INTERVAL)
+            break
+        except asyncio.TimeoutError:
+            await training_scheduler.poll()
+
+    await training_scheduler.shutdown(settings.TRAINING_SHUTDOWN_TIMEOUT)
+    await db.dispose_engines()
+
+
+def run_trainer(metrics_directory: str) -> None:
+    """runs the training jobs of every worker until the trainer is stopped"""
+
+    reset_signals()
+    workers.publish_metrics(metrics_directory, settings.SERVE_METRICS_INTERVAL)
+    asyncio.run(train_queued_jobs())
+
+
+class Master:
+    """forks and supervises the workers, relaying the messages between them"""
+
+    def __init__(self, sock: socket.socket, n_workers: int):
+        self.sock = sock
+        self.n_workers = n_workers
+        # pid of every worker to the pipe relaying messages to it and its start time
+        self.workers: dict[int, tuple[int, float]] = {}
+        self.retiring: set[int] = set()
+        self.trainer: int | None = None
+        self.metrics_directory = tempfile.mkdtemp(prefix="semiml-metrics-")
+        self.notify_r, self.notify_w = os.pipe()
+        self._buffer = b""
+        self._signals: list[int] = []
+        self._respawn_after = 0.0
+        self._trainer_started = 0.0
+
+    def spawn(self) -> None:
+        inbox_r, inbox_w = os.pipe()
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(inbox_w)
+                os.close(self.notify_r)
+                for fd, _ in self.workers.values():
+                    os.close(fd)
+                run_worker(
+                    self.sock,
+                    WorkerChannel(inbox_r, self.notify_w),
+                    self.n_workers,
+                    self.metrics_directory,
+                )
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0)
+
+        os.close(inbox_r)
+        os.set_blocking(inbox_w, False)
+        self.workers[pid] = (inbox_w, time.monotonic())
+
+    def spawn_trainer(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.sock.close()
+                os.close(self.notify_r)
+                os.close(self.notify_w)
+                for fd, _ in self.workers.values():
+                    os.close(fd)
+                run_trainer(self.metrics_directory)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0)
+
+        self.trainer = pid
+        self._trainer_started = time.monotonic()
+
+    def retire(self, pid: int) -> None:
+        """stops a worker once it finished the requests it is serving"""
+
+        self.retiring.add(pid)
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGTERM)
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(workers.metrics_file(self.metrics_directory, pid))
+
+            if pid == self.trainer:
+                self.trainer = None
+                if time.monotonic() - self._trainer_started < 1:
+                    self._respawn_after = time.monotonic() + 1
+                continue
+
+            fd, started = self.workers.pop(pid, (None, 0.0))
+            if fd is not None:
+                os.close(fd)
+            if pid not in self.retiring and time.monotonic() - started < 1:
+                # a worker failing at startup is not restarted in a tight loop
+                self._respawn_after = time.monotonic() + 1
+            self.retiring.discard(pid)
+
+    def relay(self) -> None:
+        self._buffer += os.read(self.notify_r, 65536)
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            sender, _ = decode_message(line)
+            for pid, (fd, _) in self.workers.items():
+                if pid != sender:
+                    # a worker too busy to drain its pipe only keeps its copy longer
+                    with contextlib.suppress(BlockingIOError, BrokenPipeError):
+                        os.write(fd, line + b"\n")
+
+    def reload(self) -> None:
+        loaded = preload()
+        print(f"Reloaded {loaded} live models, replacing workers", file=sys.stderr)
+
+        for pid in [pid for pid in self.workers if pid not in self.retiring]:
+            self.spawn()
+            self.retire(pid)
+
+    def stop(self) -> None:
+        for pid in list(self.workers):
+            self.retire(pid)
+        if self.trainer is not None:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(self.trainer, signal.SIGTERM)
+
+        timeout = max(
+            settings.SERVE_GRACEFUL_TIMEOUT, settings.TRAINING_SHUTDOWN_TIMEOUT
+        )
+        deadline = time.monotonic() + timeout + 5
+        while (self.workers or self.trainer) and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+
+        stragglers = list(self.workers)
+        if self.trainer is not None:
+            stragglers.append(self.trainer)
+        for pid in stragglers:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGKILL)
+        while self.workers or self.trainer:
+            time.sleep(0.1)
+            self.reap()
+
+        shutil.rmtree(self.metrics_directory, ignore_errors=True)
+
+    def run(self) -> None:
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        signal.set_wakeup_fd(wakeup_w)
+        for sig in SIGNALS:
+            signal.signal(sig, lambda sig, frame: self._signals.append(sig))
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.notify_r, selectors.EVENT_READ)
+        selector.register(wakeup_r, selectors.EVENT_READ)
+
+        while True:
+            for key, _ in selector.select(timeout=1.0):
+                if key.fd == self.notify_r:
+                    self.relay()
+                else:
+                    with contextlib.suppress(BlockingIOError):
+                        os.read(wakeup_r, 4096)
+
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return
+                if sig == signal.SIGHUP:
+                    self.reload()
+
+            self.reap()
+            if time.monotonic() < self._respawn_after:
+                continue
+            if self.trainer is None:
+                self.spawn_trainer()
+            active = len(self.workers) - len(self.retiring)
+            for _ in range(self.n_workers - active):
+                self.spawn()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.serve")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    args = parser.parse_args()
+
+    if settings.INFERENCE_EXECUTOR == "process":
+        print(
+            "INFERENCE_EXECUTOR=process is ignored, workers score on threads",
+            file=sys.stderr,
+        )
+
+    loaded = preload()
+    print(f"Preloaded {loaded} live models", file=sys.stderr)
+
+    sock = uvicorn.Config(app, host=args.host, port=args.port).bind_socket()
+    print(
+        f"Serving on {args.host}:{args.port} with {args.workers} workers",
+        file=sys.stderr,
+    )
+    Master(sock, args.workers).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,8 @@
 Configuration file for pytest
 """
 
+import asyncio
+
 import pytest
 import pytest_asyncio
 
@@ -13,6 +15,8 @@ from app.main import app
 
 AUTHENTICATED_TEST_USER_EMAIL = "dr.stone@senku.com"
 AUTHENTICATED_TEST_USER_PASSWORD = "#1ScienceNow"
+OTHER_TEST_USER_EMAIL = "kohaku@senku.com"
+OTHER_TEST_USER_PASSWORD = "#2ScienceNow"
 
 
 @pytest_asyncio.fixture
@@ -55,3 +59,55 @@ async def auth_client():
             async_client.headers.update({"Authorization": f"Bearer {token}"})
 
             yield async_client
+
+
+@pytest_asyncio.fixture
+async def other_user_headers(auth_client: httpx.AsyncClient):
+    """authorization headers of a user other than the one of auth_client"""
+
+    await auth_client.post(
+        "/auth/register",
+        json={"email": OTHER_TEST_USER_EMAIL, "password": OTHER_TEST_USER_PASSWORD},
+    )
+
+    res = await auth_client.post(
+        "/auth/jwt/login",
+        data={"username": OTHER_TEST_USER_EMAIL, "password": OTHER_TEST_USER_PASSWORD},
+    )
+
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+TEST_CSV = "a,b,c,label\n" + "".join(
+    f"{i},{i * 2},{i % 3},{'odd' if i % 2 else 'even'}\n" for i in range(60)
+)
+
+
+@pytest_asyncio.fixture
+async def live_experiment(auth_client: httpx.AsyncClient):
+    res = await auth_client.post(
+        "/files/",
+        data={"title": "test data"},
+        files={"file": ("test_data.csv", TEST_CSV.encode(), "text/csv")},
+    )
+    file = res.json()
+
+    res = await auth_client.post(
+        "/experiments/",
+        json={"title": "test_experiment", "file_id": file["id"], "target_col": "label"},
+    )
+    experiment = res.json()
+
+    for _ in range(100):
+        res = await auth_client.get(f"/experiments/{experiment['id']}")
+        if res.json()["model_schema"]:
+            break
+        await asyncio.sleep(0.1)
+
+    res = await auth_client.post(f"/experiments/live/{experiment['id']}")
+    experiment = res.json()
+
+    yield experiment
+
+    await auth_client.delete(f"/experiments/{experiment['id']}")
+    await auth_client.delete(f"/files/{file['id']}")
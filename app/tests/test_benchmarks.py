@@ -0,0 +1,51 @@
+"""
+Testing for the statistics of the benchmark suite
+"""
+
+from app.benchmarks.suite import compare, percentile, summarize
+
+
+def test_percentile():
+    values = [float(v) for v in range(100, 0, -1)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile(values, 0) == 1
+
+    # the nearest rank is rounded up
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50) == 3
+    assert percentile([], 50) == 0.0
+
+    stats = summarize([0.1, 0.2, 0.3, 0.4], errors=1, elapsed=2.0)
+    assert stats["throughput"] == 2.0
+    assert stats["p50"] == 0.2
+    assert stats["p99"] == 0.4
+
+
+def test_compare():
+    baseline = {
+        "scenarios": {
+            "predict": {"errors": 0, "throughput": 100.0, "p95": 0.1},
+            "upload": {"errors": 2, "throughput": 10.0, "p95": 1.0},
+        }
+    }
+    current = {
+        "scenarios": {
+            # within the tolerance, or better
+            "upload": {"errors": 2, "throughput": 9.5, "p95": 0.5},
+            # slower beyond the tolerance, with an error
+            "predict": {"errors": 1, "throughput": 80.0, "p95": 0.125},
+            # not in the baseline
+            "training": {"errors": 0, "rows_per_second": 1.0},
+        }
+    }
+
+    regressions = compare(current, baseline, tolerance=0.1)
+    assert regressions == [
+        "predict.errors: 0 -> 1",
+        "predict.throughput: 100 -> 80 (-20.0%)",
+        "predict.p95: 0.1 -> 0.125 (+25.0%)",
+    ]
+
+    assert compare(baseline, baseline, tolerance=0.0) == []
@@ -0,0 +1,458 @@
+"""
+Basic testing for application experiments endpoints
+"""
+
+import asyncio
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+import pytest
+
+import httpx
+
+from fastapi import FastAPI, status
+
+from app.core import cache, db, training
+from app.core.batching import MicroBatcher
+from app.core.executor import BoundedExecutor, ExecutorSaturated, inference_executor
+from app.core.inference import SchemaError
+from app.core.middleware import MetricsMiddleware
+from app.core.training import TrainingScheduler, training_scheduler
+from app.core.watchdog import LOOP_STALLS, LoopWatchdog
+from app.models.experiments import Experiment
+from app.models.jobs import TrainingJob
+from app.tests.conftest import TEST_CSV
+
+
+@pytest.mark.asyncio
+async def test_predict_model(auth_client: httpx.AsyncClient, live_experiment: dict):
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}", json={"input": [3, 6, 0]}
+    )
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json()["output"] in ("0", "1")
+
+
+@pytest.mark.asyncio
+async def test_predict_model_batch(
+    auth_client: httpx.AsyncClient, live_experiment: dict
+):
+    rows = [[i, i * 2, i % 3] for i in range(10)]
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/batch", json={"rows": rows}
+    )
+    assert res.status_code == status.HTTP_200_OK
+    outputs = res.json()["outputs"]
+    assert len(outputs) == len(rows)
+
+    columns = {"c": [row[2] for row in rows], "a": [row[0] for row in rows]}
+    columns["b"] = [row[1] for row in rows]
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/batch", json={"columns": columns}
+    )
+    assert res.status_code == status.HTTP_200_OK
+    assert res.json()["outputs"] == outputs
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/batch",
+        json={"rows": [[1, 2, 0], [1, 2]]},
+    )
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}", json={"input": [3, 6]}
+    )
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+    assert res.json()["detail"] == "rows must have 3 values"
+
+
+@pytest.mark.asyncio
+async def test_microbatcher():
+    calls = []
+
+    async def predict(rows):
+        calls.append(len(rows))
+        if len(rows[0]) != 2:
+            raise SchemaError("rows must have 2 values")
+        if any(row[0] == "bad" for row in rows):
+            raise ValueError("bad value")
+        return [row[0] * 10 for row in rows]
+
+    batcher = MicroBatcher("test", predict, max_size=8, max_wait=0.05)
+
+    # concurrent rows are scored together, a full batch without waiting
+    started = time.monotonic()
+    results = await asyncio.gather(*(batcher.submit([i, 0]) for i in range(8)))
+    assert results == [i * 10 for i in range(8)]
+    assert calls == [8]
+    assert time.monotonic() - started < 0.05
+
+    # a partial batch is scored after the maximum wait
+    calls.clear()
+    started = time.monotonic()
+    assert await batcher.submit([5, 0]) == 50
+    assert calls == [1]
+    assert time.monotonic() - started >= 0.05
+
+    # a bad row only fails its own caller, found by halving the batch
+    calls.clear()
+    rows = [[i, 0] for i in range(8)]
+    rows[5] = ["bad", 0]
+    results = await asyncio.gather(
+        *(batcher.submit(row) for row in rows), return_exceptions=True
+    )
+    assert isinstance(results.pop(5), ValueError)
+    assert results == [i * 10 for i in range(8) if i != 5]
+    assert sorted(calls, reverse=True) == [8, 4, 4, 2, 2, 1, 1]
+
+    # rows of the wrong width fail together, without being retried
+    calls.clear()
+    results = await asyncio.gather(
+        *(batcher.submit([i, 0, 0]) for i in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(result, SchemaError) for result in results)
+    assert calls == [3]
+
+
+@pytest.mark.asyncio
+async def test_predict_model_csv(auth_client: httpx.AsyncClient, live_experiment: dict):
+    rows = [[i, i * 2, i % 3] for i in range(10)]
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/batch", json={"rows": rows}
+    )
+    outputs = res.json()["outputs"]
+
+    # columns are matched by name whatever their order, extra columns are ignored
+    content = "c,label,a,b\n" + "".join(f"{c},odd,{a},{b}\n" for a, b, c in rows)
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/csv",
+        files={"file": ("scored_data.csv", content.encode(), "text/csv")},
+    )
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["content-type"].startswith("text/csv")
+    assert res.text.splitlines() == ["output", *outputs]
+
+    res = await auth_client.post(
+        "/files/",
+        data={"title": "scored data"},
+        files={"file": ("scored_data.csv", content.encode(), "text/csv")},
+    )
+    file = res.json()
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/csv",
+        data={"file_id": file["id"], "output": "ndjson"},
+    )
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["output"] for line in res.text.splitlines()] == outputs
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/csv",
+        files={"file": ("partial_data.csv", b"a,b\n1,2\n", "text/csv")},
+    )
+    assert res.status_code == status.HTTP_400_BAD_REQUEST
+    assert res.json()["detail"] == "missing columns: c"
+
+    await auth_client.delete(f"/files/{file['id']}")
+
+
+@pytest.mark.asyncio
+async def test_predict_model_saturated(
+    auth_client: httpx.AsyncClient, live_experiment: dict, monkeypatch
+):
+    monkeypatch.setattr(inference_executor, "max_pending", 0)
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/batch", json={"rows": [[3, 6, 0]]}
+    )
+    assert res.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert res.headers["retry-after"] == "1"
+
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/csv",
+        files={"file": ("scored_data.csv", TEST_CSV.encode(), "text/csv")},
+    )
+    assert res.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_executor_wait():
+    executor = BoundedExecutor("test_wait", "thread", workers=2, max_pending=1)
+    release = threading.Event()
+
+    first = asyncio.create_task(executor.run(release.wait, 10))
+    await asyncio.sleep(0.01)
+    waiting = asyncio.create_task(executor.run(sum, [1, 2], wait=True))
+    await asyncio.sleep(0.01)
+
+    # the waiting call holds no slot, but keeps later calls from overtaking it
+    assert executor._pending == 1
+    with pytest.raises(ExecutorSaturated):
+        await executor.run(sum, [])
+
+    release.set()
+    assert await first is True
+    assert await waiting == 3
+    executor.shutdown(wait=True)
+
+
+@pytest.mark.asyncio
+async def test_experiment_job(auth_client: httpx.AsyncClient, live_experiment: dict):
+    res = await auth_client.get(f"/experiments/{live_experiment['id']}/job")
+    assert res.status_code == status.HTTP_200_OK
+
+    job = res.json()
+    assert job["status"] == "succeeded"
+    assert job["started"] <= job["finished"]
+
+
+@pytest.mark.asyncio
+async def test_experiment_job_owner(
+    auth_client: httpx.AsyncClient, live_experiment: dict, other_user_headers: dict
+):
+    res = await auth_client.get(
+        f"/experiments/{live_experiment['id']}/job", headers={"Authorization": ""}
+    )
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+
+    res = await auth_client.get(
+        f"/experiments/{live_experiment['id']}/job", headers=other_user_headers
+    )
+    assert res.status_code == status.HTTP_401_UNAUTHORIZED
+    assert "status" not in res.json()
+
+
+@pytest.mark.asyncio
+async def test_experiment_job_restart(
+    auth_client: httpx.AsyncClient, live_experiment: dict
+):
+    # jobs a stopped process left running or queued
+    experiment_id = uuid.UUID(live_experiment["id"])
+    async with db.async_session_maker() as session:
+        interrupted = TrainingJob(experiment_id=experiment_id, status="running")
+        queued = TrainingJob(experiment_id=experiment_id)
+        session.add_all([interrupted, queued])
+        await session.commit()
+
+    await training_scheduler.start()
+
+    async with db.async_session_maker() as session:
+        job = await session.get(TrainingJob, interrupted.id)
+        assert job.status == "failed"
+        assert job.error == "interrupted by a restart"
+
+    for _ in range(100):
+        async with db.async_session_maker() as session:
+            job = await session.get(TrainingJob, queued.id)
+        if job.status not in ("queued", "running"):
+            break
+        await asyncio.sleep(0.1)
+    assert job.status == "succeeded"
+
+
+@pytest.mark.asyncio
+async def test_experiment_untrained(auth_client: httpx.AsyncClient):
+    res = await auth_client.get("/users/me")
+    user_id = uuid.UUID(res.json()["id"])
+
+    # queued, running or failed jobs leave the experiment without a model
+    async with db.async_session_maker() as session:
+        experiment = Experiment(
+            title="untrained", target_col="label", file_id="", user_id=user_id
+        )
+        session.add(experiment)
+        await session.commit()
+
+    res = await auth_client.post(f"/experiments/live/{experiment.id}")
+    assert res.status_code == status.HTTP_409_CONFLICT
+
+    async with db.async_session_maker() as session:
+        experiment = await session.get(Experiment, experiment.id)
+        experiment.live = True
+        await session.commit()
+
+    res = await auth_client.post(
+        f"/experiments/model/{experiment.id}", json={"input": [1, 2, 0]}
+    )
+    assert res.status_code == status.HTTP_409_CONFLICT
+
+    res = await auth_client.delete(f"/experiments/{experiment.id}")
+    assert res.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_experiment_deleted_while_training(
+    auth_client: httpx.AsyncClient, live_experiment: dict, monkeypatch
+):
+    experiment_id = uuid.UUID(live_experiment["id"])
+    started, deleted = threading.Event(), threading.Event()
+
+    def train_model(data_path, target_col, path, n_jobs=1):
+        started.set()
+        deleted.wait(10)
+        with open(path, "wb") as f:
+            f.write(b"model")
+        return training.TrainedModel("schema", 1, 0.1)
+
+    monkeypatch.setattr(training, "train_model", train_model)
+    scheduler = TrainingScheduler(max_concurrent=1, max_cores=1)
+    scheduler._executor = ThreadPoolExecutor(1)
+
+    async with db.async_session_maker() as session:
+        job = TrainingJob(experiment_id=experiment_id)
+        session.add(job)
+        await session.commit()
+
+    scheduler.submit(job.id)
+    await asyncio.to_thread(started.wait, 10)
+    res = await auth_client.delete(f"/experiments/{experiment_id}")
+    assert res.status_code == status.HTTP_200_OK
+    deleted.set()
+
+    # the task finishes without an error and the model trained too late is removed
+    await asyncio.gather(*scheduler._tasks)
+    await scheduler.shutdown(wait=True)
+    assert not os.path.exists(training.model_path(experiment_id))
+
+    async with db.async_session_maker() as session:
+        job = await session.get(TrainingJob, job.id)
+    assert job is None or job.status == "failed"
+
+
+@pytest.mark.asyncio
+async def test_metrics(auth_client: httpx.AsyncClient, live_experiment: dict):
+    rows = [[i, i * 2, i % 3] for i in range(10)]
+    res = await auth_client.post(
+        f"/experiments/model/{live_experiment['id']}/batch", json={"rows": rows}
+    )
+    assert res.status_code == status.HTTP_200_OK
+
+    res = await auth_client.get("/metrics")
+    assert res.status_code == status.HTTP_200_OK
+    metrics = res.text
+
+    # requests are labelled by route template, not by path
+    assert (
+        'semiml_http_request_duration_seconds_count{method="POST",'
+        'route="/experiments/model/{id}/batch",status="200"}'
+    ) in metrics
+    assert (
+        f'semiml_inference_batch_rows_sum{{experiment="{live_experiment["id"]}"}} 10'
+    ) in metrics
+    assert 'semiml_training_jobs_total{status="succeeded"}' in metrics
+    assert 'semiml_event_loop_lag_quantile_seconds{quantile="0.99"}' in metrics
+
+
+@pytest.mark.asyncio
+async def test_loop_stall_report(caplog):
+    blocking_app = FastAPI()
+
+    @blocking_app.get("/block/{ms}")
+    async def block(ms: int):
+        time.sleep(ms / 1000)
+        return {}
+
+    blocking_app.add_middleware(MetricsMiddleware)
+    transport = httpx.ASGITransport(app=blocking_app)
+
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.1)
+    stalls = LOOP_STALLS.value
+    watchdog.start()
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            with caplog.at_level(logging.WARNING, logger="app.core.watchdog"):
+                res = await client.get("/block/300")
+                assert res.status_code == status.HTTP_200_OK
+    finally:
+        await watchdog.stop()
+
+    assert LOOP_STALLS.value > stalls
+    assert "event loop blocked for" in caplog.text
+    assert "in GET /block/{ms}" in caplog.text
+    assert "time.sleep(ms / 1000)" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_training_core_budget():
+    scheduler = TrainingScheduler(max_concurrent=3, max_cores=8)
+    budgets, in_use = [], []
+
+    async def train(job_id, n_jobs):
+        budgets.append(n_jobs)
+        in_use.append(scheduler.cores_in_use)
+        await asyncio.sleep(0.05)
+
+    scheduler._train = train
+
+    async def run(n_jobs: int, alone: bool = False) -> None:
+        budgets.clear()
+        if alone:
+            scheduler.submit(uuid.uuid4())
+            await asyncio.sleep(0.01)
+            n_jobs -= 1
+        for _ in range(n_jobs):
+            scheduler.submit(uuid.uuid4())
+        await asyncio.sleep(0)
+        while scheduler.queued or scheduler.running:
+            await asyncio.sleep(0.01)
+
+    # a job starting alone keeps a core for each other job that could start
+    await run(5, alone=True)
+    assert budgets[:3] == [6, 1, 1]
+    assert max(in_use) <= 8
+
+    # jobs queued together share the cores
+    await run(3)
+    assert sorted(budgets) == [2, 3, 3]
+    assert max(in_use) <= 8
+
+
+def test_model_cache_load(tmp_path, monkeypatch):
+    model = {"coef": np.zeros((100, 10)), "classes": np.arange(2), "name": "model"}
+    path = str(tmp_path / "model.pkl")
+    joblib.dump(model, path)
+
+    # the arrays are counted once however often they are referenced
+    assert cache.footprint([model, model]) == 8000 + 16 + 5
+
+    # the arrays of an estimator are reached through the states it would pickle
+    forest = RandomForestClassifier(n_estimators=5, random_state=0)
+    forest.fit(np.random.rand(500, 3), np.arange(500) % 2)
+    assert 0.9 < cache.footprint(forest) / len(pickle.dumps(forest)) <= 1
+
+    loads = []
+    release = threading.Event()
+
+    def load(path):
+        loads.append(path)
+        release.wait(1)
+        return joblib.numpy_pickle.load(path)
+
+    monkeypatch.setattr(cache.joblib, "load", load)
+    model_cache = cache.ModelCache(max_bytes=1 << 20)
+
+    # concurrent misses of one model load it once
+    with ThreadPoolExecutor(4) as pool:
+        results = [pool.submit(model_cache.get, "key", path) for _ in range(4)]
+        time.sleep(0.05)
+        release.set()
+        models = [result.result() for result in results]
+
+    assert loads == [path]
+    assert all(loaded is models[0] for loaded in models)
+    assert model_cache.size == 8021
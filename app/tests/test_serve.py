@@ -0,0 +1,78 @@
+"""
+Smoke testing for the preforking server
+"""
+
+import contextlib
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def metrics_pids(client: httpx.Client) -> set[str]:
+    """pids of the processes in the metrics served by one worker"""
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    return set(re.findall(r'worker="(\d+)"', res.text))
+
+
+def wait_for_processes(client: httpx.Client, timeout: float) -> set[str]:
+    """pids in the metrics once both workers and the trainer published them"""
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pids = metrics_pids(client)
+        except httpx.TransportError:
+            pids = set()
+        if len(pids) == 3:
+            return pids
+        assert time.monotonic() < deadline, f"processes in the metrics: {pids}"
+        time.sleep(0.1)
+
+
+def test_prefork_serve():
+    port = free_port()
+    env = {
+        **os.environ,
+        "SERVE_MAX_REQUESTS": "5",
+        "SERVE_MAX_REQUESTS_JITTER": "0",
+        "SERVE_PRELOAD_MODELS": "false",
+        "SERVE_METRICS_INTERVAL": "0.1",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", str(port)]
+        + ["--workers", "2"],
+        env=env,
+    )
+
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=10) as client:
+            started = wait_for_processes(client, timeout=60)
+
+            # workers are replaced after 5 requests, the trainer is kept
+            seen = set(started)
+            for _ in range(40):
+                with contextlib.suppress(httpx.TransportError):
+                    seen |= metrics_pids(client)
+                time.sleep(0.05)
+
+            current = wait_for_processes(client, timeout=10)
+            assert len(seen) > 3
+            assert current & started, "the trainer was replaced"
+            assert server.poll() is None
+    finally:
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=60) == 0
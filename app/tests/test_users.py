@@ -2,12 +2,17 @@
 Basic testing for application users endpoints
 """
 
+import json
+
 import pytest
 
 import httpx
 
 from fastapi import status
 
+from app.core.config import settings
+from app.core.user_cache import user_cache
+
 
 @pytest.mark.asyncio
 async def test_users_me(auth_client: httpx.AsyncClient):
@@ -17,3 +22,41 @@ async def test_users_me(auth_client: httpx.AsyncClient):
     info = res.json()
 
     assert info["email"] == "dr.stone@senku.com"
+
+
+@pytest.mark.asyncio
+async def test_users_me_cached(auth_client: httpx.AsyncClient):
+    hits = user_cache.hits
+    await auth_client.get("/users/me")
+    res = await auth_client.get("/users/me")
+    assert res.status_code == status.HTTP_200_OK
+    assert user_cache.hits > hits
+
+    # an update drops the cached user, the next request sees the change
+    res = await auth_client.patch("/users/me", json={"email": "dr.stone@kingdom.com"})
+    assert res.status_code == status.HTTP_200_OK
+    res = await auth_client.get("/users/me")
+    assert res.json()["email"] == "dr.stone@kingdom.com"
+
+    await auth_client.patch("/users/me", json={"email": "dr.stone@senku.com"})
+
+
+@pytest.mark.asyncio
+async def test_profile_request(auth_client: httpx.AsyncClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "PROFILE_TARGET", str(tmp_path))
+
+    # only superusers may ask for a profile
+    res = await auth_client.get("/users/me", headers={"X-Profile": "1"})
+    assert res.status_code == status.HTTP_200_OK
+    assert "x-profile-id" not in res.headers
+
+    monkeypatch.setattr(settings, "PROFILE_SAMPLE_RATE", 1.0)
+    res = await auth_client.get("/users/me")
+    assert res.status_code == status.HTTP_200_OK
+    profile_id = res.headers["x-profile-id"]
+
+    assert (tmp_path / f"{profile_id}.folded").exists()
+    trace = json.loads((tmp_path / f"{profile_id}.trace.json").read_text())
+    names = [event["name"] for event in trace["traceEvents"]]
+    assert names[0] == "GET /users/me"
+    assert "auth.read_token" in names